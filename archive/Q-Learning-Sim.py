@@ -1,8 +1,12 @@
 
 import math
 import random
+import sys
 import numpy as np
-from shapely.geometry import Point, LineString
+sys.path.append('../simulation')
+
+from proximity import NUM_SENSORS, ProximitySensors, sensor_values
+from kinematics import ARENA_ROBOT, integrate
 
 
 environment_settings = {
@@ -13,97 +17,27 @@ environment_settings = {
 
 
 class HorizontalSensors:
-    def __init__(self, num_beams, max_distance_cm):
-        self.num_beams = num_beams
+    def __init__(self, num_beams, max_distance_cm, walls=None):
+        # The Thymio has 7 beams (5 front, 2 back); num_beams is kept for old callers
+        self.num_beams = NUM_SENSORS
         self.max_distance_cm = max_distance_cm
+        self.sensors = ProximitySensors(walls, max_range=max_distance_cm)
 
 
     def generate_scans(self, robot_pose, robots):
-        x = robot_pose.x
-        y = robot_pose.y
-        theta = robot_pose.theta
-        
-        # Calculate the starting angle based on the robot's heading
-        starting_angle = theta
-
-        # Initialize a list to store distances for each beam
-        distances = []
-        intersect_points = []
-
-        for angle in np.linspace(-math.pi / 8, math.pi / 8, 5, endpoint=False): ## ADAPT TO ACTUAL ANGLE OF SENSORS
-            # Correct angle considering the starting angle and Pygame coordinate system
-            corrected_angle = starting_angle + angle
-            x2, y2 = (x + self.max_distance_cm * math.cos(corrected_angle), y + self.max_distance_cm * math.sin(corrected_angle))
-        
-            # Calculate the end point of the beam
-            end_point = Point(x2, y2)
-
-            # Create a LineString representing the Lidar beam
-            front_sensors = LineString([(x, y), end_point])
-            print("Front sensors: ", front_sensors)
-            
-            # Check for intersections with obstacles
-            intersection = self._check_intersections(front_sensors, robots)
-
-            # Calculate distance based on intersection or max distance
-            if intersection:
-                distance = Point(x, y).distance(intersection)
-                intersect_points.append(intersection)
-            else:
-                distance = self.max_distance_cm
-                intersect_points.append(end_point)
-            distances.append(distance)
-
-        return distances, intersect_points
+        # Cast all beams of the robot against the other robots in one batch
+        poses = [robot_pose] + [robot for robot in robots if robot is not robot_pose]
+        distances, points = self.sensors.scan([pose.x for pose in poses],
+                                              [pose.y for pose in poses],
+                                              [pose.theta for pose in poses])
+        intersect_points = [tuple(point) for point in points[0]]
+        return distances[0].tolist(), intersect_points
 
 
-    def _calculate_end_point(self, robot_pose, angle):
-        """
-        Calculate the end point of the Lidar beam based on the robot's pose and angle.
-
-        Parameters:
-            - robot_pose (Point): The current pose (location) of the robot with x, y, and theta.
-            - angle (float): The angle of the Lidar beam in degrees.
-
-        Returns:
-            - Point: The end point of the Lidar beam.
-        """
-        x = robot_pose.x
-        y = robot_pose.y
-        theta = robot_pose.theta + angle  # Add angle to initial theta
-
-        # Ensure the angle is within the valid range (0 to 360 degrees)
-        theta %= 360
-
-        # Convert angle to radians
-        angle_rad = math.radians(theta)
-
-        # Calculate the end point coordinates
-        x_end = x + self.max_distance_cm * math.cos(angle_rad)
-        y_end = y + self.max_distance_cm * math.sin(angle_rad)
-
-        return Point(x_end, y_end)
-    
-
-    def _check_intersections(self, lidar_beam, robots):
-        """
-        Check for intersections between the Lidar beam and obstacles.
-
-        Parameters:
-            - lidar_beam (LineString): LineString representing the Lidar beam.
-            - obstacles (list of LineString): List of LineString objects representing obstacles.
-
-        Returns:
-            - Point or None: The closest intersection point if there is one, otherwise None.
-        """
-        intersection_points = [lidar_beam.intersection(Point(robot.x, robot.y)) for robot in robots]
-        # Filter valid points and ensure they are of type Point
-        valid_intersections = [point for point in intersection_points if not point.is_empty and isinstance(point, Point)]
-        if valid_intersections:
-            closest_intersection = min(valid_intersections, key=lambda point: lidar_beam.project(point))
-            return closest_intersection
-        else:
-            return None
+    def read(self, robot_pose, robots):
+        # Raw prox.horizontal values, using the calibration of report/plots.ipynb
+        distances, _ = self.generate_scans(robot_pose, robots)
+        return sensor_values(np.array([distances]))[0].astype(int)
 
 
 class AvoiderRobot:
@@ -140,28 +74,14 @@ class AvoiderRobot:
     
 
     def move(self, delta_time):
-        
-        # Assume maximum linear velocity at motor speed 500
-        v_max = 10  # pixels/second
-        
-        # Calculate the linear velocity of each wheel
-        left_wheel_velocity = (self.left_motor_speed / 500) * v_max
-        right_wheel_velocity = (self.right_motor_speed / 500) * v_max
-        
-        v_x = math.cos(self.theta) * (self.wheel_radius * (left_wheel_velocity + right_wheel_velocity) / 2)
-        v_y = math.sin(self.theta) * (self.wheel_radius * (left_wheel_velocity + right_wheel_velocity) / 2)
-        omega = (self.wheel_radius * (left_wheel_velocity - right_wheel_velocity)) / (2 * self.axl_dist)
-        
-        self.x += (v_x * delta_time)
-        self.y += (v_y * delta_time)
-        self.theta += (omega * delta_time)
-
-        # Ensure the orientation is within the range [0, 2*pi)
-        self.theta = self.theta % (2 * math.pi)
-
-        # Add a small amount of noise to the orientation
+        # Assume maximum linear velocity at motor speed 500 (v_max = 10 pixels/second);
+        # same kinematics as the vectorised DifferentialDrive with ARENA_ROBOT
         noise = random.gauss(0, self.odometry_noise_level)
-        self.theta += noise
+        self.x, self.y, self.theta = integrate(
+            self.x, self.y, self.theta, self.left_motor_speed, self.right_motor_speed, delta_time,
+            self.wheel_radius, self.axl_dist, motor_scale=ARENA_ROBOT["motor_scale"],
+            turn_sign=ARENA_ROBOT["turn_sign"], noise=noise)
+        self.x, self.y, self.theta = float(self.x), float(self.y), float(self.theta)
 
 
     def set_motor_speeds(self, left_motor_speed, right_motor_speed):
@@ -299,6 +219,7 @@ if __name__ == "__main__":
     sensor_readings, _intersect_points_estimated = sensors.generate_scans(seeker, robots)
 
     print(sensor_readings)
+    print(sensors.read(seeker, robots))
 
     import sys; sys.exit()
 
@@ -1,16 +1,40 @@
 import time
 import numpy as np
-from robot2 import ThymioController
-import threading
+
+# An event preempts a running manoeuvre of a lower priority, and restarts
+# the same one; others wait for it to finish
+PRIORITY = {
+    "TAGGED": 4,
+    "BLOCKED": 3,
+    "REFLEX": 3,
+    "TURN_AROUND": 2,
+    "LINE_LEFT": 2,
+    "LINE_RIGHT": 2,
+    "SAFE": 1,
+    "SAFE_STOP": 1,
+    "SEEK": 1,
+    "CRUISE": 0,
+}
+
 
 class behaviouralModule:
+    """Tick based state machine for the avoider and seeker behaviours.
+
+    update() never blocks: a manoeuvre such as turning away from an obstacle
+    is a state with a deadline, and the motors are set once when it is
+    entered. Every tick first checks the events (tagged, obstacle, black
+    line), which take over from a running manoeuvre of a lower priority.
+    Call it often, e.g. at 50 Hz.
+    """
+
     def __init__(self,
                  thymio,
                  max_speed=80,
                  thresholds={"robot": 1200, "black-line": 150, "safe-zone": 800, "front": 2000},
                  image_settings={"height": 616, "width": 820, "min_area": 6000, "blr": 1},
                  debug=False,
-                 robot_type="AVOIDER"):
+                 robot_type="AVOIDER",
+                 rng: np.random.Generator = None):
         self.max_speed = max_speed
         self.thymio = thymio
         self.image_settings = image_settings
@@ -21,113 +45,144 @@ class behaviouralModule:
         self.last_collision_time = 0
         self.last_random = 0
         self.random_timeout = 4
+        self.rng = rng if rng is not None else np.random.default_rng()
         self.collision_timeout = 2
+        self.last_seq = 0  # Sequence number of the last sensor snapshot used
+        self.state = "CRUISE"
+        self.deadline = None  # End of the current manoeuvre
         thymio.set_motors([0, 0])
 
     def set_motor_speed(self, left_motor, right_motor):
         self.thymio.set_motors([left_motor, right_motor])
 
-    def update(self):
-        front_sensors = np.array(self.thymio.horizontal_sensors[:5])
-        # back_sensors = np.array(self.thymio.horizontal_sensors[5:])
-        ground_sensors = np.array(self.thymio.ground_sensors)
-        #print(front_sensors)
+    def enter(self, state, now, duration=None, motors=None):
+        if self.debug and state != self.state: print(f"{self.state} -> {state}")
+        self.state = state
+        self.deadline = now + duration if duration is not None else None
+        if motors is not None:
+            self.set_motor_speed(*motors)
 
+    def check_events(self, snapshot, front_sensors, ground_sensors):
+        # Most urgent event as (state, duration, motors), None if there is none
+        if snapshot.rx == 1 and self.robot_type == "AVOIDER":
+            return "TAGGED", None, (0, 0)
+
+        if self.thymio.reflexes is not None:
+            # The Thymio runs the obstacle and black line reactions itself
+            if self.thymio.reflex_active:
+                return "REFLEX", 0, None
+            return None
+
+        half_speed = self.max_speed // 2
         # Something blocking the way
         if (front_sensors > self.thresholds["front"]).any():
-            self.set_motor_speed(self.max_speed, -self.max_speed)
-            if self.debug: print("Blocked")
-            self.last_collision_time = time.time()
-            time.sleep(0.5)
-            controller.is_safe = False
+            return "BLOCKED", 0.5, (self.max_speed, -self.max_speed)
+        # Line in front -> Turning 180
+        if (ground_sensors < self.thresholds["black-line"]).all():
+            return "TURN_AROUND", 1, (half_speed, -half_speed)
+        # Black line at left -> Turning right
+        if ground_sensors[0] < self.thresholds["black-line"]:
+            return "LINE_LEFT", 0.2, (half_speed, -half_speed)
+        # Black line at right -> Turning left
+        if ground_sensors[1] < self.thresholds["black-line"]:
+            return "LINE_RIGHT", 0.2, (-half_speed, half_speed)
+        return None
+
+    def update(self, now=None):
+        # Work on one snapshot, so all sensors come from the same reading
+        snapshot = self.thymio.snapshot
+        if snapshot is None:
             return
+        self.last_seq = snapshot.seq
+        now = time.monotonic() if now is None else now
+        front_sensors = np.array(snapshot.prox[:5])
+        # back_sensors = np.array(snapshot.prox[5:])
+        ground_sensors = np.array(snapshot.ground)
 
-        # Line in front
-        if (ground_sensors < self.thresholds["black-line"]).all():
-            self.set_motor_speed(self.max_speed//2, -self.max_speed//2)
-            if self.debug: print("Black line in front -> Turning 180.")
-            self.last_collision_time = time.time()
-            time.sleep(1)
-            controller.is_safe = False
+        if self.state == "TAGGED":
             return
 
-        # Black line to the left
-        if ground_sensors[0] < self.thresholds["black-line"]:
-            # Turn slightly to the right
-            if self.debug: print("Black line at left -> Turning right.")
-            self.set_motor_speed(self.max_speed//2, -self.max_speed//2)
-            self.last_collision_time = time.time()
-            controller.is_safe = False
+        running = self.deadline is not None and now < self.deadline
+        event = self.check_events(snapshot, front_sensors, ground_sensors)
+        if event is not None and (not running or event[0] == self.state
+                                  or PRIORITY[event[0]] > PRIORITY[self.state]):
+            state, duration, motors = event
+            if state == "TAGGED":
+                print("I'M SO ASHAMED!!")
+                self.thymio.set_led([32, 0, 32])
+            self.enter(state, now, duration, motors)
+            self.last_collision_time = now
+            self.thymio.is_safe = False
             return
 
-        # Black line to the right
-        if ground_sensors[1] < self.thresholds["black-line"]:
-            if self.debug: print("Black line at right -> Turning left.")
-            self.set_motor_speed(-self.max_speed//2, self.max_speed//2)
-            self.last_collision_time = time.time()
-            controller.is_safe = False
+        # Let the running manoeuvre finish
+        if running:
+            return
+
+        if self.state == "SAFE":
+            # Settled in the safe zone, stand still for a while
+            self.enter("SAFE_STOP", now, 2, (0, 0))
             return
-        
+        if self.state == "SAFE_STOP":
+            self.set_motor_speed(self.max_speed, self.max_speed)
+            self.thymio.set_led([0, 0, 255])
+        self.enter("CRUISE", now)
+
         if (ground_sensors > self.thresholds["safe-zone"]).all():
             if self.robot_type == "AVOIDER":
                 print(ground_sensors)
                 print("We are safe!")
-                controller.is_safe = True
-                controller.set_led([0,255,0])
-                time.sleep(1)
-                self.set_motor_speed(0, 0)
-                time.sleep(2)
-                #controller.running = False
-                self.set_motor_speed(self.max_speed, self.max_speed)
-                controller.set_led([0,0,255])
+                self.thymio.is_safe = True
+                self.thymio.set_led([0, 255, 0])
+                self.enter("SAFE", now, 1)
+                return
             else:
-                controller.set_led([225,215,0])
-
-        controller.is_safe = True
-        current_time = time.time()
-        time_since_collision = current_time - self.last_collision_time
-        time_since_last_random = current_time - self.last_random
-        #self.set_motor_speed(self.max_speed, self.max_speed)
-        
+                self.thymio.set_led([225, 215, 0])
+
+        self.cruise(now)
+
+    def cruise(self, now):
+        self.thymio.is_safe = True
+        time_since_collision = now - self.last_collision_time
+        time_since_last_random = now - self.last_random
+
         if self.robot_type == "AVOIDER":
-            controller.set_led([0,0,255])
+            self.thymio.set_led([0, 0, 255])
             if time_since_collision > self.collision_timeout:
                 # No collision in the last 2 seconds, go full speed
                 self.set_motor_speed(self.max_speed, self.max_speed)
             else:
                 # Recent collision, reduce speed to half
                 self.set_motor_speed(self.max_speed//2, self.max_speed//2)
+            return
 
+        # TODO: Follow things with camera
+        self.thymio.set_led([255, 0, 0])
+        result = self.thymio.process_image(**self.image_settings)
+        middle = self.image_settings["width"] // 2
+        sp = int((abs(result - middle) / middle) * self.max_speed)
+        if not result:
+            print("Nothing to see")
+            if time_since_last_random > self.random_timeout:
+                print("We are going random")
+                r = self.rng.random()
+                self.last_random = now
+                if r < 0.5:
+                    self.enter("SEEK", now, 0.1, (0, self.max_speed))
+                else:
+                    self.enter("SEEK", now, 0.1, (self.max_speed, 0))
+                return
+        elif result < middle:
+            print("Objective to left")
+            self.enter("SEEK", now, 0.5, (0, sp))
+            return
+        elif result > middle:
+            print("Objective to right")
+            self.enter("SEEK", now, 0.5, (sp, 0))
+            return
         else:
-            # TODO: Follow things with camera
-            controller.set_led([255,0,0])
-            result = controller.process_image(**self.image_settings)
-            sp = int((abs(result - (self.image_settings["height"]//2)) / (self.image_settings["height"]//2)) * self.max_speed)
-            if not result:
-                print("Nothing to see")
-                if time_since_last_random > self.random_timeout:
-                    print("We are going random")
-                    r = np.random.random()
-                    self.last_random = time.time()
-                    if r < 0.5:
-                        self.set_motor_speed(0, self.max_speed)
-                        time.sleep(0.1)
-                    else:
-                        self.set_motor_speed(self.max_speed, 0)
-                        time.sleep(0.1)
-                
-            elif result < (self.image_settings["height"]//2):
-                print("Objective to left")
-                self.set_motor_speed(0, sp)
-                time.sleep(0.5)
-            elif result > (self.image_settings["height"]//2):
-                print("Objective to right")
-                self.set_motor_speed(sp, 0)
-                time.sleep(0.5)
-            else:
-                print("Objective in front")
-                self.set_motor_speed(self.max_speed, self.max_speed)
-                time.sleep(0.5)
-                
-            self.set_motor_speed(self.max_speed, self.max_speed)
-            #self.set_motor_speed(0, 0)
\ No newline at end of file
+            print("Objective in front")
+            self.enter("SEEK", now, 0.5, (self.max_speed, self.max_speed))
+            return
+
+        self.set_motor_speed(self.max_speed, self.max_speed)
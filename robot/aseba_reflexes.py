@@ -0,0 +1,127 @@
+"""
+Generates Aseba code that runs the safety reflexes of behaviouralModule on
+the Thymio itself.
+
+The front obstacle and black line reactions of behaviouralModule.update
+are compiled into an `onevent prox` handler, so they react on the robot's
+next sensor update instead of after a round trip over TDM to the Pi. The
+timed turns (the time.sleep calls in update) are counted in prox events,
+which the Thymio raises 10 times per second.
+
+The handler exports these variables:
+- reflex_enabled: set it to 0 from Python to switch the reflexes off.
+- reflex_active: 1 while a reflex drives the motors. When it ends, the
+  motor targets it replaced are restored.
+- safe_zone: 1 while both ground sensors see the safe zone.
+"""
+
+# Prox events per second
+PROX_RATE = 10
+
+REFLEX_VARIABLES = """
+# Reflexes, see aseba_reflexes.py
+var reflex_enabled = 1
+var reflex_active = 0
+var reflex_ticks = 0
+var reflex_left = 0
+var reflex_right = 0
+var saved_left = 0
+var saved_right = 0
+var safe_zone = 0
+"""
+
+REFLEX_HANDLERS = """
+sub reflex_start
+    if reflex_active == 0 then
+        saved_left = motor.left.target
+        saved_right = motor.right.target
+    end
+    reflex_active = 1
+    motor.left.target = reflex_left
+    motor.right.target = reflex_right
+
+sub reflex_end
+    if reflex_active == 1 then
+        motor.left.target = saved_left
+        motor.right.target = saved_right
+    end
+    reflex_active = 0
+    reflex_ticks = 0
+
+onevent prox
+    if {safe_zone} then
+        safe_zone = 1
+    else
+        safe_zone = 0
+    end
+
+    if reflex_enabled == 0 then
+        callsub reflex_end
+    elseif {front} then
+        # Something blocking the way
+        reflex_left = {speed}
+        reflex_right = -{speed}
+        reflex_ticks = {front_ticks}
+        callsub reflex_start
+    elseif {line_front} then
+        # Line in front, turn around
+        reflex_left = {half_speed}
+        reflex_right = -{half_speed}
+        reflex_ticks = {line_ticks}
+        callsub reflex_start
+    elseif {line_left} then
+        # Black line to the left, turn right
+        reflex_left = {half_speed}
+        reflex_right = -{half_speed}
+        reflex_ticks = 1
+        callsub reflex_start
+    elseif {line_right} then
+        # Black line to the right, turn left
+        reflex_left = -{half_speed}
+        reflex_right = {half_speed}
+        reflex_ticks = 1
+        callsub reflex_start
+    elseif reflex_ticks > 0 then
+        reflex_ticks = reflex_ticks - 1
+        if reflex_ticks == 0 then
+            callsub reflex_end
+        end
+    end
+"""
+
+
+def any_of(sensor, indices, comparison):
+    return " or ".join(f"{sensor}[{i}] {comparison}" for i in indices)
+
+
+def all_of(sensor, indices, comparison):
+    return " and ".join(f"{sensor}[{i}] {comparison}" for i in indices)
+
+
+def reflex_handlers(thresholds, max_speed=80, front_time=0.5, line_time=1.0):
+    # Same rules and priorities as behaviouralModule.update
+    front = thresholds["front"]
+    black_line = thresholds["black-line"]
+    safe_zone = thresholds["safe-zone"]
+    return REFLEX_HANDLERS.format(
+        safe_zone=all_of("prox.ground.reflected", range(2), f"> {safe_zone}"),
+        front=any_of("prox.horizontal", range(5), f"> {front}"),
+        line_front=all_of("prox.ground.reflected", range(2), f"< {black_line}"),
+        line_left=f"prox.ground.reflected[0] < {black_line}",
+        line_right=f"prox.ground.reflected[1] < {black_line}",
+        speed=int(max_speed),
+        half_speed=int(max_speed) // 2,
+        front_ticks=max(1, round(front_time * PROX_RATE)),
+        line_ticks=max(1, round(line_time * PROX_RATE)),
+    )
+
+
+def with_reflexes(program, thresholds, max_speed=80):
+    # Aseba wants all variables declared before any other code, and the
+    # handlers after the program's own statements
+    return REFLEX_VARIABLES + program + reflex_handlers(thresholds, max_speed)
+
+
+if __name__ == "__main__":
+    from robot2 import AVOIDER
+    print(with_reflexes(AVOIDER, {"robot": 1200, "black-line": 150, "safe-zone": 800, "front": 2000}))
@@ -0,0 +1,111 @@
+import os
+import queue
+import threading
+import zipfile
+from collections import deque
+import cv2
+
+
+class DebugRecorder:
+    """Writes debug images from a background thread.
+
+    Only every `sample_every`-th call of sample() is recorded, and record()
+    only copies the image into a bounded queue; encoding and writing happen
+    in the writer thread. When the writer falls behind, images are dropped
+    rather than slowing down the caller.
+
+    Images are written as `<prefix><n>.jpg` files into `directory`, keeping
+    at most the newest `max_files` files (and `max_bytes` bytes, if set).
+    With `archive` set, they are stored losslessly as PNGs in that zip file
+    instead. Once it holds `max_files` images (or `max_bytes`) it is moved
+    to `<archive>.old` and a new one is started.
+    """
+
+    def __init__(self, directory="../..", prefix="image", sample_every=10, max_files=200,
+                 max_bytes=None, archive=None, queue_size=8) -> None:
+        self.directory = directory
+        self.prefix = prefix
+        self.sample_every = sample_every
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.archive_path = os.path.join(directory, archive) if archive is not None else None
+        self.samples = 0
+        self.image_id = 0
+        self.dropped = 0
+
+        self.written = deque()  # (path, size) of the files on disk, oldest first
+        self.written_bytes = 0
+        self.archive = None
+        self.archive_count = 0
+        self.archive_bytes = 0
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def sample(self) -> bool:
+        # Whether the current image should be recorded; call once per image
+        self.samples += 1
+        return self.samples % self.sample_every == 0
+
+    def record(self, image) -> bool:
+        self.image_id += 1
+        try:
+            self.queue.put_nowait((self.image_id, image.copy()))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            image_id, image = item
+            if self.archive_path is not None:
+                self.write_archive(image_id, image)
+            else:
+                self.write_file(image_id, image)
+        if self.archive is not None:
+            self.archive.close()
+
+    def write_file(self, image_id, image):
+        path = os.path.join(self.directory, f"{self.prefix}{image_id}.jpg")
+        if not cv2.imwrite(path, image):
+            print(f"Could not write {path}")
+            return
+        size = os.path.getsize(path)
+        self.written.append((path, size))
+        self.written_bytes += size
+
+        # Rolling cap: remove the oldest images
+        while self.written and (len(self.written) > self.max_files or
+                                (self.max_bytes is not None and self.written_bytes > self.max_bytes)):
+            old_path, old_size = self.written.popleft()
+            self.written_bytes -= old_size
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    def write_archive(self, image_id, image):
+        ok, png = cv2.imencode(".png", image)
+        if not ok:
+            return
+        if self.archive is None:
+            self.archive = zipfile.ZipFile(self.archive_path, "w", compression=zipfile.ZIP_STORED)
+        self.archive.writestr(f"{self.prefix}{image_id}.png", png.tobytes())
+        self.archive_count += 1
+        self.archive_bytes += len(png)
+
+        if self.archive_count >= self.max_files or (self.max_bytes is not None and self.archive_bytes >= self.max_bytes):
+            self.archive.close()
+            os.replace(self.archive_path, self.archive_path + ".old")
+            self.archive = None
+            self.archive_count = 0
+            self.archive_bytes = 0
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
@@ -2,10 +2,101 @@ import cv2
 import numpy as np
 import time
 import threading
+from collections import namedtuple
+from dataclasses import dataclass, fields
+
+# A captured image with its capture time and sequence number (1, 2, ...)
+Frame = namedtuple("Frame", ["image", "timestamp", "sequence"])
+# Where the ball is in a frame, with the capture time of that frame
+Detection = namedtuple("Detection", ["found", "cX", "cY", "area", "timestamp"])
+
+
+class FrameGrabber:
+    """Runs a camera in its own thread, into a ring of preallocated buffers.
+
+    `capture_into(buffer)` fills a buffer with the next camera image and
+    returns False when the stream has ended. read() returns the newest
+    complete Frame right away (it only waits for the very first one), so
+    callers never wait for the sensor exposure. wait_for(sequence) waits
+    for a frame newer than `sequence`. Once the stream has ended, because
+    capture_into returned False or raised, or after stop(), both return
+    None instead of the last frame: `error` is then the exception, if any.
+
+    A frame's image stays valid until the thread that read it reads a newer
+    one: the grabber never writes into the newest buffer or the one each
+    reading thread got last, so every consumer thread (e.g. the VisionWorker
+    feed and the seeker's behaviour) has a frame of its own. The ring grows
+    when more threads read than it has spare buffers.
+    """
+
+    def __init__(self, capture_into, shape, ring_size=3) -> None:
+        self.capture_into = capture_into
+        self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(max(3, ring_size))]
+        self.latest = None
+        self.latest_slot = -1
+        self.reading_slots = {}  # Slot handed out last, per reading thread
+        self.condition = threading.Condition()
+        self.running = True
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        sequence = 0
+        try:
+            while self.running:
+                with self.condition:
+                    busy = {self.latest_slot, *self.reading_slots.values()}
+                slot = next((i for i in range(len(self.buffers)) if i not in busy), len(self.buffers))
+                if slot == len(self.buffers):
+                    self.buffers.append(np.empty_like(self.buffers[0]))
+                if not self.capture_into(self.buffers[slot]):
+                    break
+                sequence += 1
+                with self.condition:
+                    self.latest = Frame(self.buffers[slot], time.time(), sequence)
+                    self.latest_slot = slot
+                    self.condition.notify_all()
+        except Exception as error:
+            print(f"Camera capture failed: {error!r}")
+            self.error = error
+        finally:
+            # Wake up the readers, there will be no newer frame
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+
+    def read(self, timeout=None) -> Frame:
+        # Newest frame, None on timeout or when the stream has ended
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.latest is not None or not self.running, timeout):
+                return None
+            if not self.running:
+                return None
+            self.reading_slots[threading.get_ident()] = self.latest_slot
+            return self.latest
+
+    def wait_for(self, sequence, timeout=None) -> Frame:
+        # Newest frame with a sequence number above `sequence`, None on
+        # timeout or when the stream has ended without one
+        def newer():
+            return self.latest is not None and self.latest.sequence > sequence
+        with self.condition:
+            self.condition.wait_for(lambda: newer() or not self.running, timeout)
+            if not newer():
+                return None
+            self.reading_slots[threading.get_ident()] = self.latest_slot
+            return self.latest
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
 
 
 class ComputerCamera:
-    def __init__(self) -> None:
+    def __init__(self, threaded=True) -> None:
         # Start capturing video
         self.cap = cv2.VideoCapture(1)
         if not self.cap.isOpened():
@@ -37,33 +128,162 @@ class ComputerCamera:
         self.cap.set(cv2.CAP_PROP_WHITE_BALANCE_BLUE_U, white_balance)  # Set the current white balance
         print("Camera settings locked. Exposure:", exposure, "White Balance:", white_balance)
 
-    def read_frame(self):
-        # Capture frame-by-frame
-        ret, frame = self.cap.read()
+        # Threaded: capture continuously in the background, read_frame()
+        # returns the newest frame without waiting
+        shape = (int(cam_driver_height), int(cam_driver_width), 3)
+        self.sequence = 0  # Frames read without a grabber
+        self.grabber = FrameGrabber(self.capture_into, shape) if threaded else None
+
+    def capture_into(self, buffer):
+        # Capture frame-by-frame, straight into the given buffer
+        ret, image = self.cap.read(buffer)
         if not ret:
+            print("Can't receive frame (stream end?). Exiting ...")
+            return False
+        if image is not buffer:
+            # The driver gave a frame of another size or layout
+            if image.shape == buffer.shape:
+                np.copyto(buffer, image)
+            else:
+                cv2.resize(image, (buffer.shape[1], buffer.shape[0]), dst=buffer)
+        return True
+
+    def read_frame(self):
+        if self.grabber is None:
+            ret, frame = self.cap.read()
+            if not ret:
+                print("Can't receive frame (stream end?). Exiting ...")
+                exit()
+            return frame
+
+        frame = self.grabber.read(timeout=5)
+        if frame is None:
             print("Can't receive frame (stream end?). Exiting ...")
             exit()
-        return frame
+        return frame.image
+
+    def read_latest(self) -> Frame:
+        # Newest frame, None when the stream has ended
+        if self.grabber is None:
+            ret, frame = self.cap.read()
+            if not ret:
+                return None
+            self.sequence += 1
+            return Frame(frame, time.time(), self.sequence)
+        return self.grabber.read()
+
+    def wait_for_frame(self, sequence, timeout=None) -> Frame:
+        if self.grabber is None:
+            # Every frame read now is newer
+            return self.read_latest()
+        return self.grabber.wait_for(sequence, timeout)
+
+
+@dataclass
+class DetectorParams:
+    """Colour and contour settings of the ball detector.
+
+    This is the source of truth for ImageProcessor; a TrackbarView only
+    edits it. The list form is the order of the trackbars.
+    """
+    hue_low: int = 19
+    hue_high: int = 41
+    sat_low: int = 145
+    sat_high: int = 255
+    val_low: int = 154
+    val_high: int = 252
+    blur: int = 3
+    min_area: int = 500
+
+    def to_list(self) -> list[int]:
+        return [getattr(self, field.name) for field in fields(self)]
+
+    def set_values(self, values):
+        for field, value in zip(fields(self), values):
+            setattr(self, field.name, value)
+
+    def blur_kernel(self) -> int:
+        # GaussianBlur needs an odd kernel size
+        return self.blur if self.blur % 2 == 1 else self.blur + 1
+
+    def lower_bound(self) -> np.ndarray:
+        return np.array([self.hue_low, self.sat_low, self.val_low])
+
+    def upper_bound(self) -> np.ndarray:
+        return np.array([self.hue_high, self.sat_high, self.val_high])
+
+
+class TrackbarView:
+    """cv2 window with one trackbar per DetectorParams field.
+
+    Moving a trackbar writes straight into the params, so nothing has to
+    poll the trackbars. The window also shows the frames given to show().
+    """
+
+    TRACKBARS = [
+        ('HUE low', 'hue_low', 359),
+        ('HUE high', 'hue_high', 359),
+        ('SAT low', 'sat_low', 255),
+        ('SAT high', 'sat_high', 255),
+        ('VAL low', 'val_low', 255),
+        ('VAL high', 'val_high', 255),
+        ('BLR', 'blur', 255),
+        ('AREA', 'min_area', 1000),
+    ]
+
+    def __init__(self, params: DetectorParams, window='image') -> None:
+        self.params = params
+        self.window = window
+        cv2.namedWindow(window)
+        for name, attribute, maximum in self.TRACKBARS:
+            cv2.createTrackbar(name, window, getattr(params, attribute), maximum,
+                               lambda value, attribute=attribute: self.on_change(attribute, value))
+
+    def on_change(self, attribute, value):
+        setattr(self.params, attribute, value)
+        print("Trackbar Values:", self.params.to_list())
+
+    def refresh(self):
+        # Move the trackbars to the current params
+        for name, attribute, _ in self.TRACKBARS:
+            cv2.setTrackbarPos(name, self.window, getattr(self.params, attribute))
+
+    def show(self, image):
+        cv2.imshow(self.window, image)
+        # todo: I doesn't show the windows if waitkey is not called ??
+        return cv2.waitKey(1)
+
+    def close(self):
+        cv2.destroyWindow(self.window)
 
 
 class ImageProcessor:
-    def __init__(self) -> None:
+    def __init__(self, params: DetectorParams = None, headless=False,
+                 tracking=False, roi_padding=16, max_misses=3) -> None:
         self.found = False
         self.height = None
         self.width = None
         self.cY = 0
         self.cX = 0
+        self.area = 0
         self.image_read_function = None
 
-        cv2.namedWindow('image')
-        cv2.createTrackbar('HUE low', 'image', 19, 359, self.print_trackbar_values)
-        cv2.createTrackbar('HUE high', 'image', 41, 359, self.print_trackbar_values)
-        cv2.createTrackbar('SAT low', 'image', 145, 255, self.print_trackbar_values)
-        cv2.createTrackbar('SAT high', 'image', 255, 255, self.print_trackbar_values)
-        cv2.createTrackbar('VAL low', 'image', 154, 255, self.print_trackbar_values)
-        cv2.createTrackbar('VAL high', 'image', 252, 255, self.print_trackbar_values)
-        cv2.createTrackbar('BLR', 'image', 3, 255, self.print_trackbar_values)
-        cv2.createTrackbar('AREA', 'image', 500, 1000, self.print_trackbar_values)
+        # Headless: detection only, no window, drawing or text
+        self.params = params if params is not None else DetectorParams()
+        self.view = None if headless else TrackbarView(self.params)
+
+        # Tracking: after a hit, only search the last bounding box padded by
+        # roi_padding. Every miss doubles the padding, and after max_misses
+        # misses in a row the whole frame is searched again.
+        # search_mode tells which search the last update did ("full"/"roi"),
+        # roi is the searched (x0, y0, x1, y1) region.
+        self.tracking = tracking
+        self.roi_padding = roi_padding
+        self.max_misses = max_misses
+        self.misses = max_misses
+        self.last_box = None
+        self.search_mode = "full"
+        self.roi = (0, 0, 0, 0)
 
     def get_frame(self):
         if self.image_read_function is None:
@@ -74,19 +294,6 @@ class ImageProcessor:
         self.image_read_function = image_read_function
 
     def update(self):
-        # Get the trackbar positions for HSV bounds
-        lower_hue = cv2.getTrackbarPos('HUE low', 'image')
-        upper_hue = cv2.getTrackbarPos('HUE high', 'image')
-        lower_saturation = cv2.getTrackbarPos('SAT low', 'image')
-        upper_saturation = cv2.getTrackbarPos('SAT high', 'image')
-        lower_value = cv2.getTrackbarPos('VAL low', 'image')
-        upper_value = cv2.getTrackbarPos('VAL high', 'image')
-        blr = cv2.getTrackbarPos('BLR', 'image')
-        min_area = cv2.getTrackbarPos('AREA', 'image')
-        if blr%2 == 0:
-            blr+=1
-            cv2.setTrackbarPos('BLR', 'image', blr)
-
         frame = self.get_frame()
 
         # # resize to half resolution
@@ -101,23 +308,44 @@ class ImageProcessor:
         # warning - mutation of frame
         frame = cv2.resize(frame, (self.width, self.height))
 
+        mask, contours, largest_contour = self.detect(frame)
+
+        if self.view is not None:
+            self.draw(frame, mask, contours, largest_contour)
+
+    def search_region(self, frame):
+        frame_height, frame_width = frame.shape[:2]
+        if not self.tracking or self.last_box is None or self.misses >= self.max_misses:
+            self.search_mode = "full"
+            return 0, 0, frame_width, frame_height
+
+        self.search_mode = "roi"
+        x, y, w, h = self.last_box
+        padding = self.roi_padding << self.misses
+        return (max(0, x - padding), max(0, y - padding),
+                min(frame_width, x + w + padding), min(frame_height, y + h + padding))
+
+    def detect(self, frame):
+        # The detection hot path: blur, HSV, threshold and contours, on the
+        # search region only. Contours are in full frame coordinates.
+        min_area = self.params.min_area
+        self.roi = x0, y0, x1, y1 = self.search_region(frame)
+        frame = frame[y0:y1, x0:x1]
+
         # Apply Gaussian Blur and convert to HSV
         # Loop over different blur kernel sizes
         # for blr in range(1, 10, 2):  # Using odd kernel sizes from 1 to 19
         #     blurred_image = cv2.GaussianBlur(frame, (blr, blr), 0)
+        blr = self.params.blur_kernel()
         blurred_image = cv2.GaussianBlur(frame, (blr, blr), 0)
 
         hsv = cv2.cvtColor(blurred_image, cv2.COLOR_BGR2HSV)
 
-        # Set lower and upper bounds for HSV
-        lower_bound = np.array([lower_hue, lower_saturation, lower_value])
-        upper_bound = np.array([upper_hue, upper_saturation, upper_value])
-
         # Create a mask
-        mask = cv2.inRange(hsv, lower_bound, upper_bound)
+        mask = cv2.inRange(hsv, self.params.lower_bound(), self.params.upper_bound())
 
         # Optionally find and draw contours on the original frame
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
 
         # Initialize variables to find the largest contour
         largest_contour = None
@@ -131,11 +359,12 @@ class ImageProcessor:
                     largest_area = area
                     largest_contour = contour
 
-        # Draw contours and find the midpoint
+        # Find the midpoint
+        self.area = largest_area
         if largest_contour is not None:
             self.found = True
-            # Draw the largest contour in red
-            cv2.drawContours(frame, [largest_contour], -1, (0, 0, 255), 3)  # Red
+            self.last_box = cv2.boundingRect(largest_contour)
+            self.misses = 0
 
             # Calculate the centroid of the largest contour
             M = cv2.moments(largest_contour)
@@ -143,19 +372,37 @@ class ImageProcessor:
                 # Calculate x, y coordinates of the centroid
                 self.cX = int(M["m10"] / M["m00"])
                 self.cY = int(M["m01"] / M["m00"])
+        else:
+            self.found = False
+            self.misses += 1
 
-                # Draw a circle at the centroid
-                cv2.circle(frame, (self.cX, self.cY), 7, (255, 0, 0), -1)  # Blue circle
+        return mask, contours, largest_contour
 
-                # Put text on the image to display the centroid coordinates
-                cv2.putText(frame, f'X: {self.cX}, Y: {self.cY}', (self.cX + 10, self.cY - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)  # White text
+    def draw(self, frame, mask, contours, largest_contour):
+        min_area = self.params.min_area
 
-                resolution = 10
-                mapped_x = int(self.cX * resolution / self.width)
-                mapped_y = int(self.cY * resolution / self.height)
-                cv2.putText(frame, f'X: {mapped_x}, Y: {mapped_y}', (self.cX + 10, self.cY - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)  # White text
-        else:
-            self.found = False
+        # The mask only covers the search region
+        x0, y0, x1, y1 = self.roi
+        if self.search_mode == "roi":
+            full_mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+            full_mask[y0:y1, x0:x1] = mask
+            mask = full_mask
+            cv2.rectangle(frame, (x0, y0), (x1 - 1, y1 - 1), (255, 255, 0), 1)  # Cyan
+
+        if largest_contour is not None:
+            # Draw the largest contour in red
+            cv2.drawContours(frame, [largest_contour], -1, (0, 0, 255), 3)  # Red
+
+            # Draw a circle at the centroid
+            cv2.circle(frame, (self.cX, self.cY), 7, (255, 0, 0), -1)  # Blue circle
+
+            # Put text on the image to display the centroid coordinates
+            cv2.putText(frame, f'X: {self.cX}, Y: {self.cY}', (self.cX + 10, self.cY - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)  # White text
+
+            resolution = 10
+            mapped_x = int(self.cX * resolution / self.width)
+            mapped_y = int(self.cY * resolution / self.height)
+            cv2.putText(frame, f'X: {mapped_x}, Y: {mapped_y}', (self.cX + 10, self.cY - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)  # White text
 
         # Draw other contours in green
         for contour in contours:
@@ -170,10 +417,7 @@ class ImageProcessor:
         # combined = np.hstack((blurred_image, mask_3channel))
 
         # Display the combined image
-        cv2.imshow('image', combined)
-
-        # todo: I doesn't show the windows if waitkey is not called ??
-        if cv2.waitKey(1) == ord('q'):
+        if self.view.show(combined) == ord('q'):
             self.quit()
             exit()
 
@@ -183,34 +427,17 @@ class ImageProcessor:
             self.update()
 
     def quit(self):
-        # Release the capture and close windows
-        self.cap.release()
+        # Close windows
         cv2.destroyAllWindows()
 
-    def print_trackbar_values(self, trackbar_values):
-        # Retrieve all trackbar values and print them in a list format
-        values = [
-            cv2.getTrackbarPos('HUE low', 'image'),
-            cv2.getTrackbarPos('HUE high', 'image'),
-            cv2.getTrackbarPos('SAT low', 'image'),
-            cv2.getTrackbarPos('SAT high', 'image'),
-            cv2.getTrackbarPos('VAL low', 'image'),
-            cv2.getTrackbarPos('VAL high', 'image'),
-            cv2.getTrackbarPos('BLR', 'image'),
-            cv2.getTrackbarPos('AREA', 'image')
-        ]
-        print("Trackbar Values:", values)
+    def print_trackbar_values(self, trackbar_values=None):
+        print("Trackbar Values:", self.params.to_list())
 
     def set_trackbar_values(self, values):
-        # Set all trackbars from a list of values
-        cv2.setTrackbarPos('HUE low', 'image', values[0])
-        cv2.setTrackbarPos('HUE high', 'image', values[1])
-        cv2.setTrackbarPos('SAT low', 'image', values[2])
-        cv2.setTrackbarPos('SAT high', 'image', values[3])
-        cv2.setTrackbarPos('VAL low', 'image', values[4])
-        cv2.setTrackbarPos('VAL high', 'image', values[5])
-        cv2.setTrackbarPos('BLR', 'image', values[6])
-        cv2.setTrackbarPos('AREA', 'image', values[7])
+        # Set all detector params (and trackbars) from a list of values
+        self.params.set_values(values)
+        if self.view is not None:
+            self.view.refresh()
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
 from robot2 import ThymioController
+from debug_recorder import DebugRecorder
 from BehaviouralModule import behaviouralModule
 import time
 import threading
@@ -7,7 +8,13 @@ if __name__ == "__main__":
 
     robot_type = "AVOIDER" ## SET HERE THE ROBOT TYPE
 
-    controller = ThymioController(robot_type=robot_type)
+    max_speed = 0
+    thresholds = {"robot": 1200, "black-line": 150, "safe-zone": 800, "front": 2000}
+
+    # Stream camera frames at the size the behaviour processes them, and run
+    # the obstacle and black line reactions on the Thymio
+    controller = ThymioController(robot_type=robot_type, camera_size=(820, 616),
+                                  reflexes=thresholds, reflex_speed=max_speed, recorder=DebugRecorder())
     print("LED set to WHITE")
     controller.set_led([255, 255, 255])  # Set the LED to WHITE
     time.sleep(0.5)
@@ -16,11 +23,12 @@ if __name__ == "__main__":
     else:
         controller.set_led([255, 0, 0])  # Set the LED to RED
     
-    b = behaviouralModule(controller, debug=True, max_speed=0, robot_type=robot_type)
+    b = behaviouralModule(controller, thresholds=thresholds, debug=True, max_speed=max_speed, robot_type=robot_type)
     def behavior_loop():
         while True:
             b.update()
-            time.sleep(0.2)
+            # Tick at 50 Hz, or sooner when new sensor values arrive
+            controller.wait_for_sensors(b.last_seq, timeout=0.02)
     thread = threading.Thread(target=behavior_loop, daemon=True)
     thread.start()
 
@@ -0,0 +1,565 @@
+import mmap
+import os
+import pickle
+import struct
+import sys
+import threading
+import numpy as np
+
+# Q-value of a (state, action) pair that has never been stored
+UNVISITED = -1.0
+
+
+def _field_property(shift: int, bits: int, kind: type):
+    mask = (1 << bits) - 1
+    return property(lambda self: kind((self.code >> shift) & mask))
+
+
+class State:
+    """Immutable Q-learning state packed into one integer, `code`.
+
+    Every feature in FIELDS owns a fixed bit field of `code`, so codes are
+    dense in range(State.count) and a State can index a dict or an array
+    directly (`values[state]`). States are interned: building the same state
+    twice returns the same object, so the learning loop allocates nothing.
+    `str()` gives the legacy "X#7#:F#True#" form used as key in old tables.
+    To add a feature, append it to FIELDS and pass it to the constructor.
+    """
+
+    __slots__ = ("code",)
+
+    map_resolution = 15
+    # (attribute, legacy prefix, type, bit width)
+    FIELDS = (
+        ("mapped_x", "X", int, 4),
+        ("found", "F", bool, 1),
+    )
+    count = 1 << sum(field[3] for field in FIELDS)
+    _interned: list = [None] * count
+
+    def __new__(cls, *values):
+        return cls.from_code(cls.encode(*values))
+
+    @classmethod
+    def encode(cls, *values) -> int:
+        code = 0
+        shift = 0
+        for (name, _, _, bits), value in zip(cls.FIELDS, values):
+            value = int(value)
+            if not 0 <= value < (1 << bits):
+                raise ValueError(f"{name}={value} does not fit in {bits} bits")
+            code |= value << shift
+            shift += bits
+        return code
+
+    @classmethod
+    def from_code(cls, code: int) -> "State":
+        state = cls._interned[code]
+        if state is None:
+            state = object.__new__(cls)
+            object.__setattr__(state, "code", code)
+            cls._interned[code] = state
+        return state
+
+    @classmethod
+    def observe(cls, image_processor) -> "State":
+        mapped_x = int(image_processor.cX * cls.map_resolution / image_processor.width)
+        return cls(mapped_x, image_processor.found)
+
+    @classmethod
+    def encode_array(cls, *values) -> np.ndarray:
+        # encode() for whole arrays of feature values, gives an array of codes
+        codes = 0
+        shift = 0
+        for (_, _, _, bits), value in zip(cls.FIELDS, values):
+            codes = codes | (np.asarray(value, dtype=np.int64) << shift)
+            shift += bits
+        return np.asarray(codes, dtype=np.int64)
+
+    @classmethod
+    def observe_array(cls, cX, found, width: int) -> np.ndarray:
+        # observe() for a batch of detections, e.g. HeadlessSimulation observations
+        mapped_x = np.asarray(cX) * cls.map_resolution // width
+        return cls.encode_array(mapped_x, found)
+
+    @classmethod
+    def from_string(cls, state_str: str) -> "State":
+        # Parses the legacy "X#7#:F#True#" form
+        items = dict(item.split("#")[:2] for item in state_str.split(":"))
+        values = []
+        for _, prefix, kind, _ in cls.FIELDS:
+            value = items.get(prefix, "0")
+            values.append(value == "True" if kind is bool else int(value))
+        return cls(*values)
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, field[0]) for field in self.FIELDS)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("State is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("State is immutable")
+
+    def __reduce__(self):
+        return State.from_code, (self.code,)
+
+    def __index__(self) -> int:
+        return self.code
+
+    def __hash__(self) -> int:
+        return self.code
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, State) and other.code == self.code
+
+    def __str__(self) -> str:
+        return ":".join(
+            "{}#{}#".format(prefix, value)
+            for (_, prefix, _, _), value in zip(self.FIELDS, self.values())
+        )
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            "{}={!r}".format(field[0], value) for field, value in zip(self.FIELDS, self.values())
+        )
+        return f"State({fields})"
+
+
+_shift = 0
+for _name, _, _kind, _bits in State.FIELDS:
+    setattr(State, _name, _field_property(_shift, _bits, _kind))
+    _shift += _bits
+del _shift, _name, _kind, _bits
+
+
+class Action:
+    def __init__(self, action):
+        self.action = action
+
+    def __str__(self) -> str:
+        return str(self.action)
+
+
+def my_hash(state: State, action: Action) -> str:
+    return "{}.{}".format(str(state), str(action))
+
+
+# Snapshot file: a fixed header, the action names, the state code of every
+# row and then the Q-values as one contiguous float32 array (row major).
+# Header: magic, version, action name size, rows, columns, State.FIELDS layout
+TABLE_MAGIC = b"QTBL"
+TABLE_VERSION = 1
+TABLE_HEADER = struct.Struct("<4sHHII32s")
+ACTION_NAME_SIZE = 16
+
+
+def state_layout() -> bytes:
+    return ",".join("{}:{}".format(field[0], field[3]) for field in State.FIELDS).encode()
+
+
+def write_snapshot(path: str, actions: list[str], values: np.ndarray):
+    # The file is written next to the old one and swapped in atomically, so
+    # readers that still map the old file are not disturbed.
+    tmp_path = path + ".tmp"
+    fw = open(tmp_path, "wb")
+    fw.write(TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, ACTION_NAME_SIZE,
+                               values.shape[0], values.shape[1], state_layout()))
+    for action_str in actions:
+        fw.write(action_str.encode().ljust(ACTION_NAME_SIZE, b"\0"))
+    fw.write(np.arange(values.shape[0], dtype="<u4").tobytes())
+    fw.write(np.ascontiguousarray(values, dtype="<f4").tobytes())
+    fw.flush()
+    os.fsync(fw.fileno())
+    fw.close()
+    os.replace(tmp_path, path)
+
+
+def is_table_file(path: str) -> bool:
+    with open(path, "rb") as fr:
+        return fr.read(len(TABLE_MAGIC)) == TABLE_MAGIC
+
+
+class QTableFile:
+    """Memory-mapped view of a snapshot written by write_snapshot.
+
+    Opening only parses the header, so it takes the same time for any table
+    size, and `values` is a NumPy view straight onto the mapping. With the
+    default read-only mapping every process that opens the same file shares
+    its pages through the OS page cache. `copy=True` maps it copy-on-write
+    instead, so the caller can modify `values` without touching the file.
+    """
+
+    def __init__(self, path: str, copy: bool = False) -> None:
+        self.path = path
+        self.copy = copy
+        self.open()
+
+    def open(self):
+        with open(self.path, "rb") as fr:
+            self.inode = os.fstat(fr.fileno()).st_ino
+            access = mmap.ACCESS_COPY if self.copy else mmap.ACCESS_READ
+            self.mm = mmap.mmap(fr.fileno(), 0, access=access)
+
+        magic, version, name_size, rows, columns, layout = TABLE_HEADER.unpack_from(self.mm, 0)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            raise ValueError(f"{self.path} is not a Q-table file")
+        self.layout = layout.rstrip(b"\0")
+
+        offset = TABLE_HEADER.size
+        self.actions = [
+            self.mm[offset + i * name_size: offset + (i + 1) * name_size].rstrip(b"\0").decode()
+            for i in range(columns)
+        ]
+        offset += columns * name_size
+        self.codes = np.frombuffer(self.mm, dtype="<u4", count=rows, offset=offset)
+        offset += rows * 4
+        self.values = np.frombuffer(self.mm, dtype="<f4", count=rows * columns, offset=offset).reshape(rows, columns)
+
+    def refresh(self) -> bool:
+        # Re-map the file if a newer snapshot replaced it
+        if os.stat(self.path).st_ino == self.inode:
+            return False
+        self.open()
+        return True
+
+    def state_codes(self) -> np.ndarray:
+        # Row codes translated to the current State.FIELDS layout
+        if self.layout == state_layout():
+            return self.codes
+        fields = [(name, int(bits)) for name, bits in (item.split(":") for item in self.layout.decode().split(","))]
+        values = {}
+        shift = 0
+        for name, bits in fields:
+            values[name] = (self.codes >> shift) & ((1 << bits) - 1)
+            shift += bits
+        codes = np.zeros_like(self.codes)
+        shift = 0
+        for name, _, _, bits in State.FIELDS:
+            codes |= values.get(name, 0) << shift
+            shift += bits
+        return codes
+
+    def print_best_action_per_state(self):
+        print_best_action_per_state(self.state_codes(), self.actions, self.values)
+
+
+def print_best_action_per_state(codes: np.ndarray, actions: list[str], values: np.ndarray):
+    visited = values != UNVISITED
+    # Unvisited entries must never win the argmax
+    best_columns = np.argmax(np.where(visited, values, -np.inf), axis=1)
+
+    # Sort states by state_str and print the best action for each state
+    best_actions = {
+        str(State.from_code(int(codes[row]))): (actions[best_columns[row]], float(values[row, best_columns[row]]))
+        for row in np.flatnonzero(visited.any(axis=1))
+    }
+    for state_str in sorted(best_actions.keys()):
+        action_str, q_value = best_actions[state_str]
+        print(f"State: {state_str}, Action: {action_str}, Q-Value: {q_value}")
+
+
+def read_snapshot(path: str) -> dict:
+    # Pickled snapshots written before the binary format
+    fr = open(path, "rb")
+    data = pickle.load(fr)
+    fr.close()
+    return data
+
+
+class QValueStore:
+    """Dense Q-table: one row per State code, one column per action.
+
+    Rows are indexed directly by `State.code` and actions are mapped to a
+    column the first time they are seen. The Q-values live in a 2-D float32
+    array, so looking up the best action is a single argmax over a row.
+    Unvisited entries hold UNVISITED. Old `training` files (a pickled dict
+    keyed by `my_hash`) are converted on load.
+
+    Persistence is journaled: every stored value is appended as a
+    "code action q" line to `<filePath>.log`, written out every
+    `flush_every` updates, so save() only flushes the tail of the log and
+    costs the same however big the table is. Once the log holds
+    `compact_every` records, save() rotates it to `<filePath>.log.old` and
+    a background thread rewrites the full snapshot at `filePath`. load()
+    reads the snapshot and replays both logs on top of it.
+
+    The snapshot is a QTableFile. load() maps it copy-on-write and, when
+    the layout matches, trains directly on the mapping, so startup does not
+    depend on the table size. Other processes can open the same snapshot
+    read-only with QTableFile and see new data after each compaction.
+    """
+
+    def __init__(self, filePath: str, flush_every: int = 10, compact_every: int = 5000) -> None:
+        self.filePath = filePath
+        self.logPath = filePath + ".log"
+        self.flush_every = flush_every
+        self.compact_every = compact_every
+        self.action_index: dict[str, int] = {}
+        self.actions: list[str] = []
+        self.values = np.full((State.count, 0), UNVISITED, dtype=np.float32)
+        self.pending: list[str] = []
+        self.log_records = 0
+        self.log = None
+        self.compaction = None
+        self.load(self.filePath)
+
+    def __len__(self) -> int:
+        # Number of stored (state, action) pairs, like the size of the old dict
+        return int(np.count_nonzero(self.values != UNVISITED))
+
+    def _action_column(self, action: str) -> int:
+        column = self.action_index.get(action)
+        if column is None:
+            column = len(self.actions)
+            extra = np.full((State.count, 1), UNVISITED, dtype=np.float32)
+            self.values = np.hstack((self.values, extra))
+            self.action_index[action] = column
+            self.actions.append(action)
+        return column
+
+    def _action_columns(self, actions: list[Action]) -> list[int]:
+        return [self._action_column(str(action)) for action in actions]
+
+    def get_q_value(self, state: State, action: Action) -> float:
+        column = self.action_index.get(str(action))
+        if column is None:
+            return UNVISITED
+        return float(self.values[state.code, column])
+
+    def get_best_action(self, state: State, possibleActions: list[Action]) -> Action:
+        columns = self._action_columns(possibleActions)
+        return possibleActions[int(np.argmax(self.values[state.code, columns]))]
+
+    def store_q_value(self, state: State, action: Action, value: float):
+        column = self._action_column(str(action))
+        self.values[state.code, column] = value
+        self.pending.append("{} {} {!r}\n".format(state.code, self.actions[column], float(value)))
+        if len(self.pending) >= self.flush_every:
+            self._flush_log()
+
+    def store_q_values(self, codes: np.ndarray, columns: np.ndarray, values: np.ndarray):
+        # Batch version of store_q_value, (codes, columns) must be unique
+        self.values[codes, columns] = values
+        self.pending.extend(
+            "{} {} {!r}\n".format(code, self.actions[column], value)
+            for code, column, value in zip(codes.tolist(), columns.tolist(), values.tolist())
+        )
+        if len(self.pending) >= self.flush_every:
+            self._flush_log()
+
+    def to_dict(self) -> dict[str, float]:
+        # Legacy representation, keyed by my_hash
+        return {
+            "{}.{}".format(state_str, action_str): q_value
+            for state_str, action_str, q_value in self._visited_items()
+        }
+
+    def from_dict(self, storage: dict[str, float]):
+        for key, q_value in storage.items():
+            state_str, action_str = key.rsplit('.', 1)
+            column = self._action_column(action_str)
+            self.values[State.from_string(state_str).code, column] = q_value
+
+    def _flush_log(self):
+        if self.log is None:
+            self.log = open(self.logPath, "a")
+        self.log.write("".join(self.pending))
+        self.log.flush()
+        self.log_records += len(self.pending)
+        self.pending = []
+
+    def _replay_log(self, path: str) -> int:
+        if not os.path.exists(path):
+            return 0
+        replayed = 0
+        with open(path) as fr:
+            for line in fr:
+                if not line.endswith("\n"):
+                    # Torn last line after a crash: it may still parse, as a
+                    # truncated number, so it is never replayed
+                    continue
+                try:
+                    code, action_str, q_value = line.split()
+                    code, q_value = int(code), float(q_value)
+                except ValueError:
+                    continue
+                column = self._action_column(action_str)
+                self.values[code, column] = q_value
+                replayed += 1
+        return replayed
+
+    def _compact(self, actions: list[str], values: np.ndarray):
+        write_snapshot(self.filePath, actions, values)
+        if os.path.exists(self.logPath + ".old"):
+            os.remove(self.logPath + ".old")
+
+    def save(self):
+        # Only the records since the last save are written here
+        if self.pending:
+            self._flush_log()
+        if self.log is not None:
+            os.fsync(self.log.fileno())
+        compacting = self.compaction is not None and self.compaction.is_alive()
+        if self.log_records >= self.compact_every and not compacting:
+            # Start a new log; everything in the old one is in this copy
+            self.log.close()
+            self.log = None
+            os.replace(self.logPath, self.logPath + ".old")
+            self.log_records = 0
+            self.compaction = threading.Thread(
+                target=self._compact, args=(list(self.actions), self.values.copy()), daemon=True)
+            self.compaction.start()
+        print("saved: table size", len(self))
+
+    def close(self):
+        # Fold the whole journal into the snapshot, e.g. on a clean shutdown
+        if self.pending:
+            self._flush_log()
+        if self.compaction is not None:
+            self.compaction.join()
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        if self.log_records:
+            self._compact(list(self.actions), self.values)
+            os.remove(self.logPath)
+            self.log_records = 0
+
+    # Loads a Q-table (dense snapshot or legacy dict) and replays the journal.
+    def load(self, file: str):
+        if os.path.exists(file) and is_table_file(file):
+            table = QTableFile(file, copy=True)
+            columns = [self._action_column(action_str) for action_str in table.actions]
+            codes = table.state_codes()
+            if np.array_equal(codes, np.arange(State.count)) and columns == list(range(len(columns))):
+                # Same layout: train straight on the copy-on-write mapping
+                self.values = table.values
+            else:
+                self.values[np.ix_(codes, columns)] = table.values
+        elif os.path.exists(file):
+            data = read_snapshot(file)
+            if isinstance(data.get("values"), np.ndarray):
+                columns = [self._action_column(action_str) for action_str in data["actions"]]
+                codes = [State.from_string(state_str).code for state_str in data["states"]]
+                self.values[np.ix_(codes, columns)] = data["values"]
+            else:
+                self.from_dict(data)
+        replayed = self._replay_log(self.logPath + ".old") + self._replay_log(self.logPath)
+        print("Loading: table size", len(self), "replayed records", replayed)
+        if replayed or not os.path.exists(file) or os.path.exists(self.logPath):
+            # Fold the journal into a fresh snapshot before training resumes,
+            # so new records are never appended to a torn line
+            self._compact(list(self.actions), self.values)
+            if os.path.exists(self.logPath):
+                os.remove(self.logPath)
+
+    def print_best_actions(self):
+        for state, state_values in self._visited_rows():
+            # Only consider the actions that were actually stored for this state
+            possible_actions = [
+                self.str_to_action(action_str)
+                for action_str, q_value in zip(self.actions, state_values) if q_value != UNVISITED
+            ]
+            best_action = self.get_best_action(state, possible_actions)
+            print(f"State: {state}, Best Action: {best_action}")
+
+    def str_to_state(self, state_str: str) -> State:
+        return State.from_string(state_str)
+
+    def str_to_action(self, action_str: str) -> Action:
+        return Action(action_str)
+
+    def _visited_rows(self):
+        # (State, row of Q-values) for every state with at least one stored pair
+        for code in np.flatnonzero((self.values != UNVISITED).any(axis=1)):
+            yield State.from_code(int(code)), self.values[code]
+
+    def _visited_items(self):
+        # (state_str, action_str, q_value) for every stored pair
+        codes, columns = np.nonzero(self.values != UNVISITED)
+        for code, column in zip(codes, columns):
+            yield str(State.from_code(int(code))), self.actions[column], float(self.values[code, column])
+
+    def print_all_values(self):
+        # Sort the stored pairs by state
+        sorted_items = sorted(self._visited_items(), key=lambda item: item[0])
+
+        # Print each sorted state-action pair with its Q-value
+        for state_str, action_str, q_value in sorted_items:
+            print(f"State: {state_str}, Action: {action_str}, Q-Value: {q_value}")
+
+    def print_best_action_per_state(self):
+        print_best_action_per_state(np.arange(State.count), self.actions, self.values)
+
+    def print_all_values_sorted_by_action(self):
+        # Sort the stored pairs by action
+        sorted_items = sorted(self._visited_items(), key=lambda item: item[1])
+
+        # Print each sorted state-action pair with its Q-value
+        for state_str, action_str, q_value in sorted_items:
+            print(f"State: {state_str}, Action: {action_str}, Q-Value: {q_value}")
+
+
+
+class BatchQLearner:
+    """Tabular Q-learning over a batch of transitions, e.g. from the
+    environments of a HeadlessSimulation.
+
+    States are arrays of State codes and actions are indices into `actions`.
+    The parameters mean the same as in q_learning: an action is random with
+    probability `explorationRandomness`, or when the best known action is
+    still UNVISITED, and every (state, action) is moved towards
+    reward + discountRate * maxQ by `learningRate`.
+
+    When one (state, action) occurs k times in a batch, the targets are
+    accumulated first and the pair is updated once, as if it had been
+    updated k times in a row with their mean:
+    q <- (1 - learningRate)^k * q + (1 - (1 - learningRate)^k) * mean(target).
+    """
+
+    def __init__(self, store: QValueStore, actions: list[Action], learningRate, discountRate,
+                 explorationRandomness, rng: np.random.Generator = None):
+        self.store = store
+        self.actions = actions
+        self.columns = np.array(store._action_columns(actions))
+        self.learningRate = learningRate
+        self.discountRate = discountRate
+        self.explorationRandomness = explorationRandomness
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def q_values(self, states: np.ndarray) -> np.ndarray:
+        # (batch, actions) Q-values of the given states
+        return self.store.values[states[:, None], self.columns[None, :]]
+
+    def choose_actions(self, states: np.ndarray) -> np.ndarray:
+        q_values = self.q_values(states)
+        best = np.argmax(q_values, axis=1)
+        unvisited = q_values[np.arange(len(states)), best] == UNVISITED
+        explore = (self.rng.random(len(states)) < self.explorationRandomness) | unvisited
+        random_actions = self.rng.integers(len(self.actions), size=len(states))
+        return np.where(explore, random_actions, best)
+
+    def update(self, states: np.ndarray, actions: np.ndarray, rewards: np.ndarray, next_states: np.ndarray) -> float:
+        # Returns the average absolute change of the updated Q-values
+        values = self.store.values
+        maxQ = self.q_values(next_states).max(axis=1)
+        target = rewards + self.discountRate * maxQ
+
+        # Accumulate per (state, column) like np.add.at, bincount is faster
+        flat = states * values.shape[1] + self.columns[actions]
+        counts = np.bincount(flat, minlength=values.size)
+        sums = np.bincount(flat, weights=target, minlength=values.size)
+        touched = np.flatnonzero(counts)
+        codes, columns = np.divmod(touched, values.shape[1])
+
+        old_q = values[codes, columns]
+        decay = np.power(1 - self.learningRate, counts[touched])
+        new_q = decay * old_q + (1 - decay) * sums[touched] / counts[touched]
+        self.store.store_q_values(codes, columns, new_q)
+        return float(np.abs(new_q - old_q).mean())
+
+
+if __name__ == "__main__":
+    # Inspect a Q-table without loading it: python q_table.py training
+    QTableFile(sys.argv[1] if len(sys.argv) > 1 else "training").print_best_action_per_state()
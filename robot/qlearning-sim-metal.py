@@ -1,6 +1,4 @@
 import math
-import os
-import pickle
 import random
 import time
 import sys
@@ -9,148 +7,12 @@ sys.path.append('../')
 from BehaviouralModule import behaviouralModule
 from simulation.simulation import Simulation
 from image_processor import ImageProcessor
+from q_table import State, Action, QValueStore
 import threading
 
 SEEKER = 0
 AVOIDER = 1
 
-class State:
-    def __init__(self, image_processor = None, simulation = None, fromString = None) -> None:
-        if fromString is not None:
-            self.data = fromString.split(":")
-            return
-
-        self.data = []
-
-        self.map_resolution = 15
-        self.floatX = image_processor.cX / image_processor.width
-        self.distFromMiddle = 1-abs(self.floatX-0.5)
-        self.mapped_x = int(image_processor.cX * self.map_resolution / image_processor.width)
-        self.mapped_y = int(image_processor.cY * self.map_resolution / image_processor.height)
-        self.found = image_processor.found
-        self.current_action = simulation.current_action
-
-        self.data.append("X#" + str(self.mapped_x) + "#")
-        self.data.append("F#" + str(self.found) + "#")
-        # self.data.append(self.current_action)
-
-    def __str__(self) -> str:
-        joined_string = ":".join(str(item) for item in self.data)
-        return joined_string
-
-
-class Action:
-    def __init__(self, action):
-        self.action = action
-
-    def __str__(self) -> str:
-        return str(self.action)
-
-
-def my_hash(state: State, action: Action) -> str:
-    return "{}.{}".format(str(state), str(action))
-
-
-class QValueStore:
-    def __init__(self, filePath: str) -> None:
-        self.filePath = filePath
-        self.storage: dict[str, float] = {}
-        self.load(self.filePath)
-
-    def get_q_value(self, state: State, action: Action) -> float:
-        h = my_hash(state, action)
-        return self.storage.get(h, -1.0)  # Default to -1 if not found
-
-    def get_best_action(self, state: State, possibleActions: list[Action]) -> Action:
-        return max(possibleActions, key=lambda action: self.get_q_value(state, action))
-
-    def store_q_value(self, state: State, action: Action, value: float):
-        h = my_hash(state, action)
-        self.storage[h] = value
-
-    def save(self):
-        fw = open(self.filePath, "wb")
-        pickle.dump(self.storage, fw)
-        fw.close()
-        print("saved: dictionary size", len(self.storage))
-
-    # Loads a Q-table.
-    def load(self, file: str):
-        if os.path.exists(file):
-            fr = open(file, "rb")
-            self.storage = pickle.load(fr)
-            print("Loading: dictionary size", len(self.storage))
-            fr.close()
-        else:
-            self.save()
-
-    def print_best_actions(self):
-        best_actions = {}
-
-        # Collect all unique states from the stored state-action pairs
-        unique_states = {key.split('.')[0] for key in self.storage.keys()}
-
-        for state_str in unique_states:
-            # Create a mock State object from the state_str if needed
-            state = self.str_to_state(state_str)
-
-            # Get all actions associated with this state in the storage
-            possible_actions = [
-                self.str_to_action(key.split('.')[1])
-                for key in self.storage.keys() if key.startswith(state_str + ".")
-            ]
-
-
-            # Find the best action
-            if possible_actions:
-                best_action = self.get_best_action(state, possible_actions)
-                best_actions[state] = best_action
-                print(f"State: {state}, Best Action: {best_action}")
-            else:
-                print(f"No actions found for state: {state}")
-
-    def str_to_state(self, state_str: str) -> State:
-        return State(fromString=state_str)
-
-    def str_to_action(self, action_str: str) -> Action:
-        return Action(action_str)
-
-    def print_all_values(self):
-        # Sort the storage items by `state_str` (first part of the key)
-        sorted_items = sorted(self.storage.items(), key=lambda item: item[0].split('.')[0])
-
-        # Print each sorted state-action pair with its Q-value
-        for key, q_value in sorted_items:
-            state_str, action_str = key.split('.')
-            print(f"State: {state_str}, Action: {action_str}, Q-Value: {q_value}")
-
-    def print_best_action_per_state(self):
-        # Dictionary to store the best action for each state
-        best_actions = {}
-
-        # Go through each item in the storage
-        for key, q_value in self.storage.items():
-            state_str, action_str = key.split('.')
-
-            # If the state is not in best_actions, or if the current q_value is higher, update it
-            if state_str not in best_actions or q_value > best_actions[state_str][1]:
-                best_actions[state_str] = (action_str, q_value)
-
-        # Sort states by state_str and print the best action for each state
-        for state_str in sorted(best_actions.keys()):
-            action_str, q_value = best_actions[state_str]
-            print(f"State: {state_str}, Action: {action_str}, Q-Value: {q_value}")
-
-    def print_all_values_sorted_by_action(self):
-        # Sort the storage items by `action_str` (second part of the key)
-        sorted_items = sorted(self.storage.items(), key=lambda item: item[0].split('.')[1])
-
-        # Print each sorted state-action pair with its Q-value
-        for key, q_value in sorted_items:
-            state_str, action_str = key.split('.')
-            print(f"State: {state_str}, Action: {action_str}, Q-Value: {q_value}")
-
-
 class ReinforcementProblem:
     def __init__(self, is_simulation=False) -> None:
         self.image_processor = ImageProcessor()
@@ -176,7 +38,7 @@ class ReinforcementProblem:
         self.ALL_ACTIONS = [left, right]
 
     def get_current_state(self) -> State:
-        return State(self.image_processor, self.simulation)
+        return State.observe(self.image_processor)
 
     # Get the available actions for the given state.
     def get_available_actions(self, state: State) -> list[Action]:
@@ -191,7 +53,8 @@ class ReinforcementProblem:
         time.sleep(0.25)
         newState = self.get_current_state()
 
-        reward = math.pow(2, newState.distFromMiddle*10)
+        distFromMiddle = 1 - abs(self.image_processor.cX / self.image_processor.width - 0.5)
+        reward = math.pow(2, distFromMiddle*10)
 
         if newState.found:
             reward += 100
@@ -281,7 +144,7 @@ def q_learning(
         if i % save_iterations == 0:
             store.save()
             average_change = total_change / num_changes
-            print(f"iteration {i}: average q-value change: {average_change:.02f} dictionary size: {len(store.storage)}")
+            print(f"iteration {i}: average q-value change: {average_change:.02f} table size: {len(store)}")
             total_change = 0
             num_changes = 0
         i += 1
@@ -293,23 +156,23 @@ if __name__ == "__main__":
     store = QValueStore("training")
     # store.print_best_actions()
     store.print_best_action_per_state()
-    problem = ReinforcementProblem(is_simulation)
 
     learning_rate = 0.1
     discount_rate = 0.75
     exploration_rate = 0.2  # on average every 5th action is random
     exploration_rate = 0.1  # to run
 
-    q_learning_update = q_learning(problem, learning_rate, discount_rate, exploration_rate)
-
-    def q_learn_loop():
-        while True:
-            q_learning_update()
-    thread = threading.Thread(target=q_learn_loop, daemon=True)
-    thread.start()
-
     # SIMULATION
     if is_simulation:
+        problem = ReinforcementProblem(is_simulation)
+        q_learning_update = q_learning(problem, learning_rate, discount_rate, exploration_rate)
+
+        def q_learn_loop():
+            while True:
+                q_learning_update()
+        thread = threading.Thread(target=q_learn_loop, daemon=True)
+        thread.start()
+
         def update():
             problem.simulation.update()
             problem.image_processor.update()
@@ -317,16 +180,32 @@ if __name__ == "__main__":
 
     # REAL WORLD
     else:
-        # Behavior Module
-        b = behaviouralModule(problem.simulation.controller, debug=True, max_speed=100, robot_type=SEEKER)
-        def behavior_loop():
-            while True:
-                b.update()
-                time.sleep(0.2)
-
-
-        thread = threading.Thread(target=behavior_loop, daemon=True)
-        thread.start()
-        # Image processing loop
-        while True:
-            problem.image_processor.update()
\ No newline at end of file
+        # Thymio, camera, behaviour and learner all run in one asyncio runtime
+        import asyncio
+        from robot2 import ThymioController
+        from debug_recorder import DebugRecorder
+        from runtime import RobotRuntime
+
+        from image_processor import DetectorParams
+        from vision_worker import VisionWorker
+
+        controller = ThymioController(robot_type="SEEKER", threaded=False, recorder=DebugRecorder())
+        # Ball detection runs in its own process, on frames from the camera thread
+        params = DetectorParams()
+        params.set_values([41, 83, 97, 151, 110, 255, 5, 30])
+        vision = VisionWorker(params)
+        vision.feed(controller.camera)
+
+        # Behavior Module, processing the frames at the 160x120 they are
+        # streamed at: min_area is the 6000 of 820x616 scaled to that size
+        image_settings = {"height": 120, "width": 160, "min_area": 6000 * (160 * 120) // (820 * 616), "blr": 1}
+        b = behaviouralModule(controller, debug=True, max_speed=100, robot_type="SEEKER",
+                              image_settings=image_settings)
+
+        runtime = RobotRuntime(controller, None, behaviour=b, store=store,
+                               learning_rate=learning_rate, discount_rate=discount_rate,
+                               exploration_rate=exploration_rate, vision_worker=vision)
+        try:
+            asyncio.run(runtime.run())
+        except KeyboardInterrupt:
+            pass
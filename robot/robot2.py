@@ -1,6 +1,8 @@
 import time
 import threading
 from thymio_camera import ThymioCamera
+from sensor_snapshot import SensorFeed
+from aseba_reflexes import with_reflexes
 from tdmclient import ClientAsync
 import cv2
 import numpy as np
@@ -72,30 +74,50 @@ onevent timer1
 """
 
 class ThymioController:
-    def __init__(self, robot_type):
-        self.motor_values = [0, 0]  # Default motor values
-        self.led_values = [0, 0, 255]  # Default LED values
+    def __init__(self, robot_type, camera_size=(160, 120), reflexes=None, reflex_speed=80, threaded=True,
+                 recorder=None):
+        self.motor_values = (0, 0)  # Default motor values
+        self.led_values = (0, 0, 255)  # Default LED values
         self.running = True
-        self.horizontal_sensors = None
-        self.ground_sensors = None
-        # Start the background thread that will run the Thymio control loop
-        self.thread = threading.Thread(target=self.run_background, daemon=True)
-        self.thread.start()
+        self.sensors = SensorFeed()
+        self.message = 0
+        self.tagged = False
+        self.sent_values = {}  # Actuator values last sent to the Thymio
+        # The Thymio node once its program runs: set_motors/set_led/set_reflexes
+        # send to it straight from their own thread, under actuator_lock
+        self.node = None
+        self.actuator_lock = threading.RLock()
         if robot_type == "SEEKER":
             self.program = SEEKER
         else:
             self.program = AVOIDER
+        # Thresholds of the safety reflexes to run on the Thymio, see aseba_reflexes.py
+        self.reflexes = reflexes
+        self.reflex_enabled = True
+        self.reflex_active = False
+        self.safe_zone = False
+        if reflexes is not None:
+            self.program = with_reflexes(self.program, reflexes, reflex_speed)
         self.robot_type = robot_type
+        # Start the background thread that will run the Thymio control loop,
+        # unless the caller runs control_program itself (see runtime.py)
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(target=self.run_background, daemon=True)
+            self.thread.start()
         self.is_safe = False
-        self.camera = ThymioCamera()
-        self.img_id = 0
+        self.camera = ThymioCamera(size=camera_size)
+        # Debug images of detections, written in the background by a
+        # DebugRecorder; None (the default) records nothing
+        self.recorder = recorder
 
 
     def process_image(self, height=120, width=160, min_area=1500, blr=3, ):
 
         # warning - mutation of frame
         frame = self.camera.read_frame()
-        frame = cv2.resize(frame, (width, height))
+        if frame.shape[:2] != (height, width):
+            frame = cv2.resize(frame, (width, height))
 
         if blr%2 == 0:
             blr+=1
@@ -129,11 +151,11 @@ class ThymioController:
                     cy = int(M['m01'] / M['m00'])  # Y coordinate of centroid
                     print(f"Centroid of the robot: ({cx}, {cy})")
                     
-                    # Draw the contour and centroid on the original image
-                    cv2.drawContours(blurred_image, [largest_contour], -1, (0, 255, 0), 3)
-                    cv2.circle(blurred_image, (cx, cy), 25, (255, 0, 0), -1)
-                    self.img_id += 1
-                    cv2.imwrite(f"../../image{self.img_id}.jpg", blurred_image)
+                    if self.recorder is not None and self.recorder.sample():
+                        # Draw the contour and centroid on the original image
+                        cv2.drawContours(blurred_image, [largest_contour], -1, (0, 255, 0), 3)
+                        cv2.circle(blurred_image, (cx, cy), 25, (255, 0, 0), -1)
+                        self.recorder.record(blurred_image)
                     return cx
                 else:
                     pass
@@ -145,78 +167,162 @@ class ThymioController:
         return False
     
 
+    def on_variables_changed(self, node, variables):
+        # Called by tdmclient with the variables that changed since the last update
+        prox = variables.get("prox.horizontal")
+        ground = variables.get("prox.ground.reflected")
+        rx = variables.get("prox.comm.rx")
+        if prox is not None or ground is not None or rx is not None:
+            self.sensors.publish(prox=prox[:7] if prox is not None else None,
+                                 ground=ground[:2] if ground is not None else None,
+                                 rx=rx[0] if rx is not None else None)
+        if "reflex_active" in variables:
+            self.reflex_active = bool(variables["reflex_active"][0])
+            if not self.reflex_active:
+                # The reflex restored the motors it replaced; make sure the
+                # latest set_motors values get sent again
+                self.sent_values.pop("motor.left.target", None)
+                self.sent_values.pop("motor.right.target", None)
+        if "safe_zone" in variables:
+            self.safe_zone = bool(variables["safe_zone"][0])
+        if rx is not None:
+            message = rx[0]
+            if message != self.message:
+                print(f"I'm a {self.robot_type} | Message receving: {message}")
+            self.message = message
+            if (message == 1) and (self.robot_type == "AVOIDER") and self.running:
+                print(f"I'M SO ASHAMED!! (msg={message})")
+                self.tagged = True
+                self.running = False
+                self.push_actuators(node, {
+                    "motor.left.target": [0],
+                    "motor.right.target": [0],
+                    "leds.top": [32, 0, 32],
+                    "leds.bottom.left": [32, 0, 32],
+                    "leds.bottom.right": [32, 0, 32],
+                })
+                return
+        # Answer new sensor values right away instead of on the next tick
+        if self.running:
+            self.push_actuators(node, self.actuator_variables())
+
+    def actuator_variables(self):
+        motor_values = self.motor_values
+        led_values = [int(value) for value in self.led_values]
+        variables = {
+            "leds.top": led_values,
+            "leds.bottom.left": led_values,
+            "leds.bottom.right": led_values,
+        }
+        if self.reflexes is not None:
+            variables["reflex_enabled"] = [int(self.reflex_enabled)]
+        # A reflex running on the Thymio has the motors until it is done
+        if not self.reflex_active:
+            variables["motor.left.target"] = [int(motor_values[0])]
+            variables["motor.right.target"] = [int(motor_values[1])]
+        return variables
+
+    def push_actuators(self, node, variables):
+        # Only send the variables that differ from what the Thymio already has
+        with self.actuator_lock:
+            changed = {name: value for name, value in variables.items() if self.sent_values.get(name) != value}
+            if changed:
+                node.send_set_variables(changed)
+                self.sent_values.update(changed)
+
+    def send_actuators(self):
+        # Send the current actuator values now, from the calling thread;
+        # send_set_variables does not need the tdmclient message pump
+        with self.actuator_lock:
+            node = self.node
+            if node is not None and self.running:
+                self.push_actuators(node, self.actuator_variables())
+
+    def control_program(self, client):
+        # The tdmclient coroutine that runs the Thymio until self.running is cleared
+        async def prog():
+            with await client.lock() as node:
+
+                # Compile and send the program to the Thymio.
+                error = await node.compile(self.program) ## IR MODULE
+                if error is not None:
+                    print(f"Compilation error: {error['error_msg']}")
+                else:
+                    error = await node.run()
+                    if error is not None:
+                        print(f"Error {error['error_code']}")
+
+                # Get the sensors pushed to us when they change instead of polling them
+                node.add_variables_changed_listener(self.on_variables_changed)
+                await node.watch(variables=True)
+
+                # Wait for the robot's proximity sensors to be ready.
+                await node.wait_for_variables({"prox.horizontal"})
+
+                self.push_actuators(node, {"leds.top": [0, 0, 32]})
+                self.node = node
+                self.send_actuators()
+                print("Thymio started successfully!")
+                while self.running:
+                    # set_motors/set_led send their values themselves and sensor
+                    # updates push in on_variables_changed; this only resyncs
+                    await client.sleep(0.5, wake=lambda: not self.running)
+                    self.send_actuators()
+
+                # Once out of the loop, stop the robot and set the top LED to red.
+                with self.actuator_lock:
+                    self.node = None
+                print("Thymio stopped successfully!")
+                self.push_actuators(node, {"motor.left.target": [0], "motor.right.target": [0]})
+                #self.push_actuators(node, {"leds.top": [32, 0, 0]})
+        return prog
+
     def run_background(self):
         # Use the ClientAsync context manager to handle the connection to the Thymio robot.
         with ClientAsync() as client:
-            async def prog():
-                with await client.lock() as node:
+            # Run the asynchronous function to control the Thymio.
+            client.run_async_program(self.control_program(client))
 
-                    # Compile and send the program to the Thymio.
-                    error = await node.compile(self.program) ## IR MODULE
-                    if error is not None:
-                        print(f"Compilation error: {error['error_msg']}")
-                    else:
-                        error = await node.run()
-                        if error is not None:
-                            print(f"Error {error['error_code']}")
-
-                    # Wait for the robot's proximity sensors to be ready.
-                    await node.wait_for_variables({"prox.horizontal"})
-
-                    node.send_set_variables({"leds.top": [0, 0, 32]})
-                    print("Thymio started successfully!")
-                    while self.running:
-
-                        message = node.v.prox.comm.rx
-                        print(f"I'm a {self.robot_type} | Message receving: {message}; Sending: {node.v.prox.comm.tx}")
-
-                        if (message == 1) and (self.robot_type == "AVOIDER"):
-                            print(f"I'M SO ASHAMED!! (msg={message})")
-                            node.v.motor.left.target = 0
-                            node.v.motor.right.target = 0
-                            node.v.leds.top = [32, 0, 32]
-                            node.v.leds.bottom.left = [32, 0, 32]
-                            node.v.leds.bottom.right = [32, 0, 32]
-                            break
-
-                        # Testing explore
-                        # self.explore()
-                        # Apply the latest motor and LED values
-                        node.v.motor.left.target = self.motor_values[0]
-                        node.v.motor.right.target = self.motor_values[1]
-                        node.v.leds.top = self.led_values
-                        node.v.leds.bottom.left = self.led_values
-                        node.v.leds.bottom.right = self.led_values
-                        # Pass the sensors to the robot
-                        h = node.v.prox.horizontal
-                        self.horizontal_sensors = [h[0], h[1], h[2], h[3], h[4], h[5], h[6]]
-                        g = node.v.prox.ground.reflected
-                        self.ground_sensors = [g[0], g[1]]
-                        # Apply changes to the Thymio
-                        node.flush()
-                        # Sleep for 0.1 seconds to prevent overloading
-                        time.sleep(0.1)
-
-                    # Once out of the loop, stop the robot and set the top LED to red.
-                    print("Thymio stopped successfully!")
-                    node.v.motor.left.target = 0
-                    node.v.motor.right.target = 0
-                    #node.v.leds.top = [32, 0, 0]
-                    node.flush()
 
-            # Run the asynchronous function to control the Thymio.
-            client.run_async_program(prog)
+    @property
+    def snapshot(self):
+        # Latest SensorSnapshot, None until the Thymio has sent its sensors
+        return self.sensors.latest
+
+    @property
+    def horizontal_sensors(self):
+        snapshot = self.sensors.latest
+        return snapshot.prox if snapshot is not None else None
+
+    @property
+    def ground_sensors(self):
+        snapshot = self.sensors.latest
+        return snapshot.ground if snapshot is not None else None
+
+    def set_reflexes(self, enabled):
+        # Switch the reflexes on the Thymio on or off, e.g. to take over the motors
+        self.reflex_enabled = enabled
+        self.send_actuators()
 
+    def wait_for_sensors(self, seq=0, timeout=None):
+        return self.sensors.wait_for(seq, timeout)
 
     def set_motors(self, values):
-        self.motor_values = values
+        # Swap in a new tuple so the TDM thread never sees half an update
+        self.motor_values = tuple(values)
+        self.send_actuators()
 
     def set_led(self, values):
-        self.led_values = values
+        self.led_values = tuple(values)
+        self.send_actuators()
 
     def stop(self):
         self.running = False
-        self.thread.join()
+        if self.thread is not None:
+            self.thread.join()
+        self.camera.stop_camera()
+        if self.recorder is not None:
+            self.recorder.close()
 
     def perform_action(self, action: str, speed: int = 100):
         print("taking::" + action)
@@ -263,18 +369,19 @@ class ThymioController:
         return
 
     def detect_surface(self):
+        ground_sensors = self.ground_sensors
         ## First, check where you are standing
-        if (self.ground_sensors[0] > 900) & (self.ground_sensors[1] > 900):  # Safe zone
+        if (ground_sensors[0] > 900) & (ground_sensors[1] > 900):  # Safe zone
             return "safe-zone"
-        elif (self.ground_sensors[0] > 900):  # Safe zone to the left
+        elif (ground_sensors[0] > 900):  # Safe zone to the left
             return "safe-zone-left"
-        elif (self.ground_sensors[1] > 900):
+        elif (ground_sensors[1] > 900):
             return "safe-zone-right"
-        elif (self.ground_sensors[0] < 400) & (self.ground_sensors[1] < 400):  # Black tape
+        elif (ground_sensors[0] < 400) & (ground_sensors[1] < 400):  # Black tape
             return "black-tape"
-        elif (self.ground_sensors[0] < 400):
+        elif (ground_sensors[0] < 400):
             return "black-tape-left"
-        elif (self.ground_sensors[0] < 400):
+        elif (ground_sensors[0] < 400):
             return "black-tape-right"
         else:
             return "open-ground"
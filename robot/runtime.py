@@ -0,0 +1,219 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from image_processor import Detection
+from q_table import State, Action, BatchQLearner
+
+
+class Latency:
+    # Duration statistics of one loop, reset after every report
+    def __init__(self, name) -> None:
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def __str__(self):
+        if self.count == 0:
+            return f"{self.name}: -"
+        return f"{self.name}: {self.count} x {1000 * self.total / self.count:.1f} ms (max {1000 * self.max:.1f} ms)"
+
+
+def put_latest(queue: asyncio.Queue, item):
+    # Bounded queue that keeps the newest items: drop the oldest when full
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+
+class RobotRuntime:
+    """Runs the real robot: an asyncio event loop coordinates threads.
+
+    asyncio only schedules the subsystems and passes data between them; the
+    blocking work runs in threads of its own. The Thymio connection (tdm),
+    ball detection (vision), the waits for a VisionWorker's detections, the
+    camera's FrameGrabber and the DebugRecorder each have their own thread.
+    The behaviour state machine and the Q-learner are tasks of the loop.
+    Vision hands its detections to the learner through a bounded queue that
+    keeps only the newest ones. OpenCV work runs in the single vision
+    thread, as it releases the GIL while it works, or in the process of a
+    VisionWorker when one is given (image_processor is then not used); the
+    seeker's behaviour ticks run in the vision thread too, as they process
+    camera images. tdmclient drives its coroutines with blocking sleeps,
+    which is why the Thymio program needs its own thread. The controller
+    must be created with threaded=False.
+
+    run() returns when one of the tasks fails, after `duration` seconds, or
+    on Ctrl+C. It then cancels the tasks, stops the motors, the vision
+    worker and the camera, and closes the debug recorder and the Q-table.
+    Per loop latencies are printed every `report_interval` seconds.
+    """
+
+    def __init__(self, controller, image_processor, behaviour=None, store=None,
+                 actions=("LEFT", "RIGHT"), learning_rate=0.1, discount_rate=0.75,
+                 exploration_rate=0.1, action_time=0.25, tick=0.02, queue_size=4,
+                 report_interval=10, vision_worker=None) -> None:
+        self.controller = controller
+        self.image_processor = image_processor
+        self.vision_worker = vision_worker
+        self.width = vision_worker.width if vision_worker is not None else None
+        self.last_timestamp = 0
+        self.behaviour = behaviour
+        self.store = store
+        self.actions = [Action(action) for action in actions]
+        self.learner = None
+        if store is not None:
+            self.learner = BatchQLearner(store, self.actions, learning_rate, discount_rate, exploration_rate)
+        self.action_time = action_time
+        self.tick = tick
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.detections = None
+        self.vision_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vision")
+        self.detection_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detections")
+        self.tdm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tdm")
+        self.latency = {name: Latency(name) for name in ("vision", "behaviour", "learner")}
+
+    def wait_for_detection(self) -> Detection:
+        # Runs in the detections thread
+        detection = self.vision_worker.wait_for(self.last_timestamp, timeout=1)
+        if detection is not None:
+            self.last_timestamp = detection.timestamp
+        return detection
+
+    def detect(self) -> Detection:
+        # Runs in the vision thread
+        self.image_processor.update()
+        processor = self.image_processor
+        self.width = processor.width
+        return Detection(processor.found, processor.cX, processor.cY, processor.area, time.time())
+
+    async def tdm_loop(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.tdm_executor, self.controller.run_background)
+
+    async def vision_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = time.perf_counter()
+            if self.vision_worker is not None:
+                detection = await loop.run_in_executor(self.detection_executor, self.wait_for_detection)
+            else:
+                detection = await loop.run_in_executor(self.vision_executor, self.detect)
+            if detection is None:
+                continue
+            self.latency["vision"].add(time.perf_counter() - start)
+            put_latest(self.detections, detection)
+
+    async def behaviour_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = time.perf_counter()
+            if self.behaviour.robot_type == "SEEKER":
+                # The seeker processes camera images
+                await loop.run_in_executor(self.vision_executor, self.behaviour.update)
+            else:
+                self.behaviour.update()
+            elapsed = time.perf_counter() - start
+            self.latency["behaviour"].add(elapsed)
+            await asyncio.sleep(max(0.0, self.tick - elapsed))
+
+    async def next_detection(self, after: float) -> Detection:
+        # First detection of a frame captured after `after`
+        while True:
+            detection = await self.detections.get()
+            if detection.timestamp > after:
+                return detection
+
+    def state_of(self, detection: Detection) -> np.ndarray:
+        return State.observe_array([detection.cX], [detection.found], self.width)
+
+    async def learner_loop(self):
+        # q_learning from qlearning-sim-metal.py, one transition at a time
+        i = 0
+        save_iterations = 100
+        total_change = 0
+        states = self.state_of(await self.next_detection(0))
+        while True:
+            start = time.perf_counter()
+            action = int(self.learner.choose_actions(states)[0])
+            if self.controller.is_safe:
+                self.controller.perform_action(str(self.actions[action]))
+            else:
+                print("Robot is not safe! Seeking disabled")
+            self.latency["learner"].add(time.perf_counter() - start)
+
+            acted = time.time()
+            await asyncio.sleep(self.action_time)
+            detection = await self.next_detection(acted)
+            new_states = self.state_of(detection)
+
+            distFromMiddle = 1 - abs(detection.cX / self.width - 0.5)
+            reward = np.array([np.power(2, distFromMiddle * 10) + 100 * detection.found])
+            total_change += self.learner.update(states, np.array([action]), reward, new_states)
+            states = new_states
+
+            i += 1
+            if i % save_iterations == 0:
+                self.store.save()
+                print(f"iteration {i}: average q-value change: {total_change / save_iterations:.02f}")
+                total_change = 0
+
+    async def report_loop(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(" | ".join(str(latency) for latency in self.latency.values()))
+            for latency in self.latency.values():
+                latency.reset()
+
+    async def run(self, duration=None):
+        self.detections = asyncio.Queue(maxsize=self.queue_size)
+        tdm = asyncio.create_task(self.tdm_loop(), name="tdm")
+        tasks = [asyncio.create_task(self.vision_loop(), name="vision"),
+                 asyncio.create_task(self.report_loop(), name="report")]
+        if self.behaviour is not None:
+            tasks.append(asyncio.create_task(self.behaviour_loop(), name="behaviour"))
+        if self.learner is not None:
+            tasks.append(asyncio.create_task(self.learner_loop(), name="learner"))
+
+        try:
+            done, _ = await asyncio.wait([tdm, *tasks], timeout=duration,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    print(f"{task.get_name()} failed: {task.exception()!r}")
+        finally:
+            await self.shutdown(tdm, tasks)
+
+    async def shutdown(self, tdm, tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Stop the motors like stop.py, then let the Thymio program finish
+        self.controller.set_motors([0, 0])
+        self.controller.running = False
+        try:
+            await asyncio.wait_for(asyncio.shield(tdm), timeout=5)
+        except asyncio.TimeoutError:
+            print("Thymio did not stop in time")
+        self.vision_executor.shutdown(wait=True)
+        if self.vision_worker is not None:
+            self.vision_worker.stop()
+        self.detection_executor.shutdown(wait=True)
+        self.tdm_executor.shutdown(wait=False)
+        # Stop the camera and write the queued debug images
+        self.controller.stop()
+        if self.store is not None:
+            self.store.close()
+        print("Runtime stopped")
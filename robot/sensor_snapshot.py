@@ -0,0 +1,57 @@
+import time
+import threading
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class SensorSnapshot:
+    """One reading of the Thymio sensors, as published by ThymioController.
+
+    Snapshots are never modified: every update makes a new one, so a
+    consumer holding a snapshot always sees prox, ground and rx from the
+    same moment. `seq` counts the updates, starting at 1.
+    """
+    prox: tuple  # prox.horizontal, 7 values
+    ground: tuple  # prox.ground.reflected, left and right
+    rx: int  # prox.comm.rx
+    seq: int
+    timestamp: float
+
+
+class SensorFeed:
+    """Latest SensorSnapshot of a single publisher (the TDM thread).
+
+    Publishing is one reference swap, so reading `latest` needs no lock.
+    The condition is only used to wake up consumers blocked in wait_for.
+    """
+
+    def __init__(self) -> None:
+        self.latest = None
+        self.condition = threading.Condition()
+
+    def publish(self, prox=None, ground=None, rx=None) -> SensorSnapshot:
+        # Values that are not given are carried over from the previous snapshot
+        previous = self.latest
+        if previous is not None:
+            prox = previous.prox if prox is None else prox
+            ground = previous.ground if ground is None else ground
+            rx = previous.rx if rx is None else rx
+        snapshot = SensorSnapshot(
+            prox=tuple(prox) if prox is not None else None,
+            ground=tuple(ground) if ground is not None else None,
+            rx=rx if rx is not None else 0,
+            seq=previous.seq + 1 if previous is not None else 1,
+            timestamp=time.time(),
+        )
+        self.latest = snapshot
+        with self.condition:
+            self.condition.notify_all()
+        return snapshot
+
+    def wait_for(self, seq=0, timeout=None) -> SensorSnapshot:
+        # Latest snapshot newer than `seq`, None on timeout
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.latest is not None and self.latest.seq > seq, timeout):
+                return None
+            return self.latest
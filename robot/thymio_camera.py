@@ -1,18 +1,35 @@
 import cv2
 import time
-from picamera2 import Picamera2
+import numpy as np
+from libcamera import Transform
+from picamera2 import Picamera2, MappedArray
+from image_processor import Frame, FrameGrabber
 
 
 class ThymioCamera:
-    def __init__(self) -> None:
+    def __init__(self, size=(160, 120), video=True, threaded=True) -> None:
         self.camera = Picamera2()
-        camera_config = self.camera.create_still_configuration({
-            "size": (1640, 1232),  # Full sensor resolution at a lower resolution
-            "format": "RGB888"  # Fast processing format
-        })
+        self.video = video
+        if video:
+            # Stream frames at processing size, scaled by the ISP, and let the
+            # sensor read out rotated by 180 degrees instead of flipping in Python
+            camera_config = self.camera.create_video_configuration(
+                main={"size": size, "format": "RGB888"},
+                transform=Transform(hflip=1, vflip=1),
+                buffer_count=4,
+            )
+        else:
+            camera_config = self.camera.create_still_configuration({
+                "size": (1640, 1232),  # Full sensor resolution at a lower resolution
+                "format": "RGB888"  # Fast processing format
+            })
         self.camera.configure(camera_config)
         self.camera.start()
 
+        # The ISP may round the size, so use the configured one
+        width, height = self.camera.camera_config["main"]["size"]
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+
         # Get current auto settings
         time.sleep(2)
         controls = self.camera.capture_metadata()
@@ -31,11 +48,49 @@ class ThymioCamera:
             "ColourGains": auto_white_balance  # Lock the current white balance gains
         })
 
+        # Threaded: capture continuously in the background, read_frame()
+        # returns the newest frame without waiting for the exposure
+        self.sequence = 0  # Frames read without a grabber
+        self.grabber = FrameGrabber(self.capture_into, self.frame.shape) if threaded else None
+
+    def capture_into(self, buffer):
+        if not self.video:
+            image = self.camera.capture_array()
+            cv2.flip(image, -1, dst=buffer)  # Rotate 180 degrees
+            return True
+
+        # Copy the small frame out of the camera buffer into our own one, so
+        # the buffer goes straight back to the camera
+        request = self.camera.capture_request()
+        try:
+            with MappedArray(request, "main") as m:
+                np.copyto(buffer, m.array[:, :buffer.shape[1], :3])
+        finally:
+            request.release()
+        return True
+
     def read_frame(self):
-        image = self.camera.capture_array()
-        image = cv2.flip(image, 0)
-        image = cv2.flip(image, 1)
-        return image
+        # The returned array is reused by later captures
+        frame = self.read_latest()
+        if frame is None:
+            raise RuntimeError("Camera stopped") from self.grabber.error
+        return frame.image
+
+    def read_latest(self) -> Frame:
+        # Newest frame, None once the camera has stopped
+        if self.grabber is None:
+            self.capture_into(self.frame)
+            self.sequence += 1
+            return Frame(self.frame, time.time(), self.sequence)
+        return self.grabber.read()
+
+    def wait_for_frame(self, sequence, timeout=None) -> Frame:
+        if self.grabber is None:
+            # Every frame captured now is newer
+            return self.read_latest()
+        return self.grabber.wait_for(sequence, timeout)
 
     def stop_camera(self):
-        self.camera.stop()
\ No newline at end of file
+        if self.grabber is not None:
+            self.grabber.stop()
+        self.camera.stop()
@@ -0,0 +1,144 @@
+import time
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+
+from image_processor import Detection, DetectorParams, ImageProcessor
+
+
+def run_worker(memory_name, shape, params, tracking, requests, results):
+    # The worker process: detect the ball in the frames of the shared ring
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        frames = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+        processor = ImageProcessor(params, headless=True, tracking=tracking)
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            slot, timestamp = request
+            processor.detect(frames[slot])
+            results.put((slot, processor.found, processor.cX, processor.cY, processor.area, timestamp))
+    finally:
+        del frames
+        memory.close()
+
+
+class VisionWorker:
+    """Ball detection in a separate process, so OpenCV runs on another core
+    than the control loop and never holds its GIL.
+
+    Frames are handed over through a ring of `slots` frame buffers in
+    shared memory: submit() copies (or resizes) a frame into a free slot
+    and only the slot number travels to the worker. The worker sends back
+    compact Detections, and the newest one is `latest`. wait_for(timestamp)
+    waits for the detection of a frame captured after `timestamp`. When all
+    slots are busy, submit() drops the frame: the worker is behind and the
+    frame would be stale by the time it gets to it.
+
+    feed(camera) starts a thread that submits every new frame of a camera
+    with a FrameGrabber (ThymioCamera or ComputerCamera).
+
+    The worker is started with "spawn" rather than fork: by then the camera,
+    recorder and libcamera threads are running, and a forked child could
+    inherit locks they hold.
+    """
+
+    def __init__(self, params: DetectorParams = None, size=(160, 120), slots=3, tracking=True) -> None:
+        self.width, self.height = size
+        shape = (slots, self.height, self.width, 3)
+        self.memory = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+        self.frames = np.ndarray(shape, dtype=np.uint8, buffer=self.memory.buf)
+        self.free_slots = list(range(slots))
+        self.slots_lock = threading.Lock()
+
+        self.latest = None
+        self.condition = threading.Condition()
+        self.running = True
+        self.feeder = None
+
+        context = mp.get_context("spawn")
+        self.requests = context.SimpleQueue()
+        self.results = context.SimpleQueue()
+        self.process = context.Process(
+            target=run_worker,
+            args=(self.memory.name, shape, params if params is not None else DetectorParams(),
+                  tracking, self.requests, self.results),
+            daemon=True)
+        self.process.start()
+        self.receiver = threading.Thread(target=self.receive, daemon=True)
+        self.receiver.start()
+
+    def submit(self, frame, timestamp=None) -> bool:
+        with self.slots_lock:
+            if not self.free_slots:
+                return False
+            slot = self.free_slots.pop()
+        if frame.shape[:2] == (self.height, self.width):
+            np.copyto(self.frames[slot], frame)
+        else:
+            cv2.resize(frame, (self.width, self.height), dst=self.frames[slot])
+        self.requests.put((slot, time.time() if timestamp is None else timestamp))
+        return True
+
+    def receive(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                break
+            slot, found, cX, cY, area, timestamp = result
+            with self.slots_lock:
+                self.free_slots.append(slot)
+            with self.condition:
+                self.latest = Detection(found, cX, cY, area, timestamp)
+                self.condition.notify_all()
+
+    def wait_for(self, timestamp=0, timeout=None) -> Detection:
+        # Newest detection of a frame captured after `timestamp`, None on timeout
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.latest is not None and self.latest.timestamp > timestamp, timeout):
+                return None
+            return self.latest
+
+    def feed(self, camera):
+        def run():
+            sequence = 0
+            while self.running:
+                frame = camera.wait_for_frame(sequence, timeout=0.5)
+                if frame is None:
+                    continue
+                sequence = frame.sequence
+                self.submit(frame.image, frame.timestamp)
+        self.feeder = threading.Thread(target=run, daemon=True)
+        self.feeder.start()
+
+    def stop(self):
+        self.running = False
+        if self.feeder is not None:
+            self.feeder.join()
+        self.requests.put(None)
+        self.process.join(timeout=5)
+        self.results.put(None)
+        self.receiver.join()
+        del self.frames
+        self.memory.close()
+        self.memory.unlink()
+
+
+if __name__ == '__main__':
+    from image_processor import ComputerCamera
+    computer_camera = ComputerCamera()
+    vision = VisionWorker()
+    vision.feed(computer_camera)
+
+    timestamp = 0
+    try:
+        while True:
+            detection = vision.wait_for(timestamp)
+            timestamp = detection.timestamp
+            print(f"{detection}, latency {1000 * (time.time() - detection.timestamp):.1f} ms")
+    except KeyboardInterrupt:
+        vision.stop()
@@ -0,0 +1,124 @@
+import math
+import time
+import numpy as np
+
+
+class UniformGrid:
+    """Points bucketed in a uniform grid of square cells, cheap enough to
+    rebuild every tick.
+
+    The points (e.g. robot or ball centres, in cm) are sorted by the key of
+    their cell, so the points of a cell are one run of the sorted order and
+    are found with a binary search. Points of different `group`s (e.g.
+    episodes) never meet. Queries first gather the points of the cells
+    around each query, then keep the ones that really are close, so their
+    cost grows with the number of queries and close pairs instead of n^2.
+    """
+
+    def __init__(self, x, y, cell_size, group=None):
+        self.x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        self.y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        self.cell_size = cell_size
+        self.group = (np.zeros(len(self.x), dtype=np.int64) if group is None
+                      else np.atleast_1d(np.asarray(group, dtype=np.int64)))
+
+        if len(self.x) > 0:
+            self.x0 = self.x.min()
+            self.y0 = self.y.min()
+        else:
+            self.x0 = self.y0 = 0.0
+        cx, cy = self.cells(self.x, self.y)
+        self.num_cx = int(cx.max()) + 1 if len(cx) else 1
+        self.num_cy = int(cy.max()) + 1 if len(cy) else 1
+        keys = self.keys(self.group, cx, cy)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.x)
+
+    def cells(self, x, y):
+        cx = np.floor((np.asarray(x) - self.x0) / self.cell_size).astype(np.int64)
+        cy = np.floor((np.asarray(y) - self.y0) / self.cell_size).astype(np.int64)
+        return cx, cy
+
+    def keys(self, group, cx, cy):
+        return (group * self.num_cx + cx) * self.num_cy + cy
+
+    def candidates(self, x, y, reach=1, group=None):
+        # (query, point) pairs of every point in the (2 * reach + 1)^2
+        # cells around each query position
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        group = (np.zeros(len(x), dtype=np.int64) if group is None
+                 else np.broadcast_to(np.asarray(group, dtype=np.int64), x.shape))
+        cx, cy = self.cells(x, y)
+
+        # Keys of all (query, neighbour cell) combinations at once
+        offsets = np.arange(-reach, reach + 1)
+        shape = (len(x), len(offsets), len(offsets))
+        nx = np.broadcast_to(cx[:, None, None] + offsets[None, :, None], shape).reshape(len(x), -1)
+        ny = np.broadcast_to(cy[:, None, None] + offsets[None, None, :], shape).reshape(len(x), -1)
+        # Cells outside the grid are empty, and must not wrap around
+        inside = (nx >= 0) & (nx < self.num_cx) & (ny >= 0) & (ny < self.num_cy)
+        key = self.keys(group[:, None], nx, ny)
+        start = np.searchsorted(self.sorted_keys, key, side="left")
+        count = np.searchsorted(self.sorted_keys, key, side="right") - start
+        count = np.where(inside, count, 0).ravel()
+
+        total = int(count.sum())
+        first = np.cumsum(count) - count
+        offsets = np.arange(total) - np.repeat(first, count)
+        queries = np.repeat(np.arange(len(x)), nx.shape[1])
+        return np.repeat(queries, count), self.order[np.repeat(start.ravel(), count) + offsets]
+
+    def query_radius(self, x, y, radius, group=None):
+        # (query, point) pairs of the points within radius of each query
+        query, point = self.candidates(x, y, math.ceil(radius / self.cell_size), group)
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        close = np.hypot(self.x[point] - x[query], self.y[point] - y[query]) <= radius
+        return query[close], point[close]
+
+    def query_ray(self, origins, directions, length, margin=0.0, group=None):
+        # (ray, point) pairs of the points within margin of each ray, a
+        # segment of `length` from its origin along its unit direction.
+        # With margin the bounding radius of an object, these are the
+        # objects the ray may hit.
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 2)
+        middles = origins + directions * (length / 2)
+        ray, point = self.query_radius(middles[:, 0], middles[:, 1], length / 2 + margin, group)
+        px = self.x[point] - origins[ray, 0]
+        py = self.y[point] - origins[ray, 1]
+        along = np.clip(px * directions[ray, 0] + py * directions[ray, 1], 0, length)
+        close = np.hypot(px - along * directions[ray, 0], py - along * directions[ray, 1]) <= margin
+        return ray[close], point[close]
+
+    def pairs(self, radius):
+        # All (i, j) pairs, i != j, of points within radius of each other
+        i, j = self.query_radius(self.x, self.y, radius, self.group)
+        different = i != j
+        return i[different], j[different]
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    num_points = 10000
+    # 1000 games of 10 robots in a 237 x 91 cm arena
+    group = np.repeat(np.arange(1000), 10)
+    x = rng.uniform(0, 237, num_points)
+    y = rng.uniform(0, 91, num_points)
+
+    steps = 20
+    start_time = time.time()
+    for _ in range(steps):
+        i, j = UniformGrid(x, y, 20, group).pairs(20)
+    elapsed_time = time.time() - start_time
+    print(f"{steps * num_points / elapsed_time:.0f} points per second, {len(i)} pairs")
+
+    # Same pairs as checking all of them
+    same = group[:, None] == group[None, :]
+    close = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :]) <= 20
+    expected = np.argwhere(same & close & ~np.eye(num_points, dtype=bool))
+    assert sorted(zip(i.tolist(), j.tolist())) == sorted(map(tuple, expected.tolist()))
@@ -0,0 +1,186 @@
+import json
+import sys
+import time
+import numpy as np
+sys.path.append('../')
+
+from robot.q_table import State, BatchQLearner
+from headless import HeadlessSimulation
+
+# Columns of a trajectory file. Steps are rows of one (step, environment);
+# the reward and state are the ones step() returned. A step that is done
+# belongs to the episode that ended, its reward and state to the next one.
+STEP_COLUMNS = ("step_env", "step_episode", "step_action", "step_reward", "step_state", "step_done")
+# Episodes: the episode number in their environment (which child of its
+# SeedSequence placed the ball), and how it started. When an episode ends
+# in the middle of an action, the rest of its ticks run in the next one
+# with the motors stopped: lead_ticks of them, after the detection
+# start_cX/start_cY of before the reset.
+EPISODE_COLUMNS = ("episode_env", "episode_index", "episode_lead_ticks",
+                   "episode_start_cX", "episode_start_cY", "episode_state")
+
+
+def get_states(simulation: HeadlessSimulation, observation: dict) -> np.ndarray:
+    return State.observe_array(observation["cX"], observation["found"], simulation.width)
+
+
+class EpisodeRunner:
+    """Runs HeadlessSimulation episodes that can be reproduced from a seed.
+
+    All randomness comes from `seed`: one SeedSequence child seeds the
+    environments (a generator per episode places the ball) and the other
+    `rng`, which chooses random actions or, with a `learner`, its
+    exploration. Time is counted in simulated ticks only, so the same seed
+    and settings give the same episodes on any machine and at any speed.
+
+    Every step is recorded in columns (see STEP_COLUMNS and
+    EPISODE_COLUMNS) and save() writes them to an npz file. replay_episode()
+    re-runs one episode of such a file bit for bit, without rendering.
+    """
+
+    def __init__(self, num_envs: int = 64, seed=None, learner: BatchQLearner = None, **simulation_settings):
+        self.seed_sequence = np.random.SeedSequence(seed)
+        simulation_seed, policy_seed = self.seed_sequence.spawn(2)
+        self.simulation_seed = simulation_seed
+        self.simulation_settings = simulation_settings
+        self.simulation = HeadlessSimulation(num_envs, seed=simulation_seed, **simulation_settings)
+        self.rng = np.random.default_rng(policy_seed)
+        self.learner = learner
+        if learner is not None:
+            learner.rng = self.rng
+
+        self.steps = {name: [] for name in STEP_COLUMNS}
+        self.episodes = {name: [] for name in EPISODE_COLUMNS}
+        self.current = np.zeros(num_envs, dtype=np.int64)  # Episode id per environment
+        self.states = get_states(self.simulation, self.simulation.reset())
+        no_lead = np.zeros(num_envs, dtype=np.int64)
+        self.start_episodes(np.arange(num_envs), no_lead, no_lead, no_lead)
+
+    def start_episodes(self, envs, lead_ticks, start_cX, start_cY):
+        first = sum(len(column) for column in self.episodes["episode_env"])
+        self.current[envs] = first + np.arange(len(envs))
+        columns = (envs, self.simulation.episodes[envs] - 1, lead_ticks,
+                   start_cX, start_cY, self.states[envs])
+        for name, values in zip(EPISODE_COLUMNS, columns):
+            self.episodes[name].append(np.asarray(values))
+
+    def choose_actions(self, states: np.ndarray) -> np.ndarray:
+        if self.learner is not None:
+            return self.learner.choose_actions(states)
+        return self.rng.integers(len(self.simulation.actions), size=len(states))
+
+    def step(self) -> float:
+        # One action in every environment, returns the mean reward
+        simulation = self.simulation
+        actions = self.choose_actions(self.states)
+        start_cX = simulation.cX.copy()
+        start_cY = simulation.cY.copy()
+        observation, rewards, dones, _ = simulation.step(actions)
+        new_states = get_states(simulation, observation)
+        if self.learner is not None:
+            self.learner.update(self.states, actions, rewards, new_states)
+
+        columns = (np.arange(simulation.num_envs), self.current, actions, rewards, new_states, dones)
+        for name, values in zip(STEP_COLUMNS, columns):
+            self.steps[name].append(np.array(values))
+        self.states = new_states
+
+        envs = np.flatnonzero(dones)
+        if len(envs):
+            self.start_episodes(envs, simulation.ticks[envs], start_cX[envs], start_cY[envs])
+        return float(rewards.mean())
+
+    def run(self, steps: int):
+        for _ in range(steps):
+            self.step()
+
+    def columns(self) -> dict:
+        columns = {name: np.concatenate(values) for name, values in {**self.steps, **self.episodes}.items()}
+        columns["step_action"] = columns["step_action"].astype(np.int8)
+        return columns
+
+    def config(self) -> dict:
+        # What replay_episode needs besides the columns
+        return {
+            "entropy": str(self.seed_sequence.entropy),
+            "spawn_key": list(self.simulation_seed.spawn_key),
+            "num_envs": self.simulation.num_envs,
+            "simulation": {"actions": list(self.simulation.actions), **self.simulation_settings},
+        }
+
+    def save(self, path: str):
+        np.savez_compressed(path, config=json.dumps(self.config()), **self.columns())
+
+
+def load_trajectories(path: str) -> dict:
+    with np.load(path) as data:
+        trajectories = {name: data[name] for name in data.files if name != "config"}
+        trajectories["config"] = json.loads(str(data["config"]))
+    return trajectories
+
+
+def replay_episode(trajectories: dict, episode: int) -> dict:
+    """Runs episode `episode` of loaded trajectories again on a single
+    environment, with its recorded actions. Returns its steps' rewards,
+    states and dones, and its first state, as recorded in the file."""
+    config = trajectories["config"]
+    env = int(trajectories["episode_env"][episode])
+    index = int(trajectories["episode_index"][episode])
+    simulation = HeadlessSimulation(num_envs=1, **config["simulation"])
+    # Continue the environment's seeds at this episode
+    simulation.seed_sequences = [np.random.SeedSequence(
+        int(config["entropy"]), spawn_key=tuple(config["spawn_key"]) + (env,), n_children_spawned=index)]
+    simulation.reset()
+
+    simulation.cX[:] = trajectories["episode_start_cX"][episode]
+    simulation.cY[:] = trajectories["episode_start_cY"][episode]
+    simulation.advance(int(trajectories["episode_lead_ticks"][episode]))
+    first_state = get_states(simulation, simulation.observe())[0]
+
+    rows = np.flatnonzero(trajectories["step_episode"] == episode)
+    rewards = np.zeros(len(rows))
+    states = np.zeros(len(rows), dtype=np.int64)
+    dones = np.zeros(len(rows), dtype=bool)
+    for i, action in enumerate(trajectories["step_action"][rows]):
+        observation, reward, done, _ = simulation.step([action])
+        rewards[i] = reward[0]
+        states[i] = get_states(simulation, observation)[0]
+        dones[i] = done[0]
+    return {"state": first_state, "rewards": rewards, "states": states, "dones": dones}
+
+
+def verify_episode(trajectories: dict, episode: int) -> bool:
+    # Whether replaying the episode gives exactly the recorded values
+    replay = replay_episode(trajectories, episode)
+    rows = trajectories["step_episode"] == episode
+    return (replay["state"] == trajectories["episode_state"][episode]
+            and np.array_equal(replay["rewards"].view(np.int64), trajectories["step_reward"][rows].view(np.int64))
+            and np.array_equal(replay["states"], trajectories["step_state"][rows])
+            and np.array_equal(replay["dones"], trajectories["step_done"][rows]))
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "trajectories.npz"
+    runner = EpisodeRunner(seed=0, num_envs=256)
+    steps = 500
+    start_time = time.time()
+    runner.run(steps)
+    elapsed_time = time.time() - start_time
+    runner.save(path)
+
+    trajectories = load_trajectories(path)
+    num_episodes = len(trajectories["episode_env"])
+    print(f"{steps * runner.simulation.num_envs / elapsed_time:.0f} steps per second, "
+          f"{num_episodes} episodes saved to {path}")
+
+    # Same seed, same trajectories
+    again = EpisodeRunner(seed=0, num_envs=256)
+    again.run(steps)
+    print("same run from the seed:", all(np.array_equal(values, trajectories[name].astype(values.dtype))
+                                         for name, values in again.columns().items()))
+
+    episodes = np.random.default_rng().choice(num_episodes, size=min(20, num_episodes), replace=False)
+    start_time = time.time()
+    replayed = [verify_episode(trajectories, episode) for episode in episodes]
+    elapsed_time = time.time() - start_time
+    print(f"{sum(replayed)} of {len(replayed)} episodes replayed bit for bit in {elapsed_time:.2f} s")
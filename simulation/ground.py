@@ -0,0 +1,143 @@
+import os
+import time
+import cv2
+import numpy as np
+
+# prox.ground.reflected of the floor types, as in archive/Q-Learning-Sim.py
+ENVIRONMENT_SETTINGS = {
+    "black_tape": 70,
+    "open_arena": 400,
+    "safe_zone": 1200,
+}
+
+# Colours (BGR) of the floor types in arena images
+PALETTE = [
+    ((30, 30, 30), "black_tape"),
+    ((255, 255, 255), "open_arena"),
+    ((210, 210, 210), "safe_zone"),
+]
+
+# Thymio ground sensors as (x, y) in the robot frame (cm from the middle of
+# the wheel axle, x forward, y to the left): left, then right
+GROUND_SENSORS = np.array([(7.2, 1.15), (7.2, -1.15)])
+
+# report/images/arena.png: the pixels inside the outer edge of the tape and
+# the size they stand for in cm
+ARENA_IMAGE = dict(
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "report", "images", "arena.png"),
+    crop=(99, 90, 1678, 701),
+    size_cm=(237, 91),
+)
+
+
+class ArenaMap:
+    """Floor of the arena as a grid of ground sensor values.
+
+    The grid has `resolution` cells per cm, its first row is the top of the
+    arena image. Positions are in cm, x from the left edge and y up from the
+    bottom edge, with theta counterclockwise from the x axis like the other
+    simulators. sample() reads the grid with bilinear interpolation and
+    clamps positions to the border, and ground_sensors() gives
+    prox.ground.reflected of many robots at once.
+    """
+
+    def __init__(self, reflectance: np.ndarray, resolution: float = 2):
+        self.reflectance = np.asarray(reflectance, dtype=np.float32)
+        self.resolution = resolution
+        self.height_cm = self.reflectance.shape[0] / resolution
+        self.width_cm = self.reflectance.shape[1] / resolution
+
+    @classmethod
+    def from_image(cls, path, size_cm, crop=None, resolution=2, palette=PALETTE,
+                   settings=ENVIRONMENT_SETTINGS, smooth=5) -> "ArenaMap":
+        # Every pixel becomes the floor type of the nearest palette colour.
+        # A median filter of `smooth` cells then removes lines and text
+        # drawn on the floor, and holes in the safe zone are filled.
+        image = cv2.imread(path)
+        if image is None:
+            raise FileNotFoundError(path)
+        if crop is not None:
+            x0, y0, x1, y1 = crop
+            image = image[y0:y1, x0:x1]
+        width = max(1, round(size_cm[0] * resolution))
+        height = max(1, round(size_cm[1] * resolution))
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+        colours = np.array([colour for colour, _ in palette], dtype=np.float32)
+        distances = ((image[:, :, None, :] - colours[None, None]) ** 2).sum(axis=-1)
+        labels = distances.argmin(axis=-1).astype(np.uint8)
+        if smooth > 1:
+            labels = cv2.medianBlur(labels, smooth | 1)
+
+        names = [name for _, name in palette]
+        if "safe_zone" in names:
+            safe = names.index("safe_zone")
+            mask = (labels == safe).astype(np.uint8)
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            cv2.drawContours(labels, contours, -1, safe, thickness=cv2.FILLED)
+
+        values = np.array([settings[name] for name in names], dtype=np.float32)
+        return cls(values[labels], resolution)
+
+    @classmethod
+    def from_arena_image(cls, resolution=2) -> "ArenaMap":
+        return cls.from_image(resolution=resolution, **ARENA_IMAGE)
+
+    @classmethod
+    def rectangle(cls, width=237, height=91, tape=5, safe_zone=(14.5, 15.5), resolution=2,
+                  settings=ENVIRONMENT_SETTINGS) -> "ArenaMap":
+        # The arena of the README: white floor, black tape around it and a
+        # gray safe zone in the middle, sizes in cm
+        def cells(cm):
+            return round(cm * resolution)
+        grid = np.full((cells(height), cells(width)), settings["black_tape"], dtype=np.float32)
+        grid[cells(tape):cells(height - tape), cells(tape):cells(width - tape)] = settings["open_arena"]
+        safe_width, safe_height = safe_zone
+        grid[cells((height - safe_height) / 2):cells((height + safe_height) / 2),
+             cells((width - safe_width) / 2):cells((width + safe_width) / 2)] = settings["safe_zone"]
+        return cls(grid, resolution)
+
+    def sample(self, x, y) -> np.ndarray:
+        # Bilinear lookup at positions in cm, any shape
+        grid_height, grid_width = self.reflectance.shape
+        gx = np.clip(np.asarray(x) * self.resolution - 0.5, 0, grid_width - 1)
+        gy = np.clip((self.height_cm - np.asarray(y)) * self.resolution - 0.5, 0, grid_height - 1)
+        x0 = np.minimum(gx.astype(np.intp), grid_width - 2) if grid_width > 1 else np.zeros_like(gx, np.intp)
+        y0 = np.minimum(gy.astype(np.intp), grid_height - 2) if grid_height > 1 else np.zeros_like(gy, np.intp)
+        x1 = np.minimum(x0 + 1, grid_width - 1)
+        y1 = np.minimum(y0 + 1, grid_height - 1)
+        fx = gx - x0
+        fy = gy - y0
+        grid = self.reflectance
+        top = grid[y0, x0] * (1 - fx) + grid[y0, x1] * fx
+        bottom = grid[y1, x0] * (1 - fx) + grid[y1, x1] * fx
+        return top * (1 - fy) + bottom * fy
+
+    def ground_sensors(self, x, y, theta) -> np.ndarray:
+        # prox.ground.reflected (N, 2) of robots at (x, y) cm heading theta
+        x = np.asarray(x, dtype=np.float64)[..., None]
+        y = np.asarray(y, dtype=np.float64)[..., None]
+        theta = np.asarray(theta, dtype=np.float64)[..., None]
+        cos_t = np.cos(theta)
+        sin_t = np.sin(theta)
+        sensor_x = x + GROUND_SENSORS[:, 0] * cos_t - GROUND_SENSORS[:, 1] * sin_t
+        sensor_y = y + GROUND_SENSORS[:, 0] * sin_t + GROUND_SENSORS[:, 1] * cos_t
+        return self.sample(sensor_x, sensor_y)
+
+
+if __name__ == '__main__':
+    arena = ArenaMap.from_arena_image()
+    for name, value in ENVIRONMENT_SETTINGS.items():
+        print(f"{name}: {(arena.reflectance == value).mean() * 100:.1f}% of {arena.width_cm:.0f} x {arena.height_cm:.0f} cm")
+
+    rng = np.random.default_rng(0)
+    num_robots = 100000
+    x = rng.uniform(0, arena.width_cm, num_robots)
+    y = rng.uniform(0, arena.height_cm, num_robots)
+    theta = rng.uniform(0, 2 * np.pi, num_robots)
+    steps = 20
+    start_time = time.time()
+    for _ in range(steps):
+        values = arena.ground_sensors(x, y, theta)
+    elapsed_time = time.time() - start_time
+    print(f"{steps * num_robots / elapsed_time:.0f} robot ground readings per second")
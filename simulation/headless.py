@@ -0,0 +1,191 @@
+import math
+import time
+import numpy as np
+
+from kinematics import SIMULATION_ROBOT, DifferentialDrive
+
+# Wheel speeds of Simulation.perform_action
+ACTION_MOTORS = {
+    "LEFT": (0, 50),
+    "RIGHT": (50, 0),
+    "FORWARD": (50, 50),
+    "STOP": (0, 0),
+}
+
+
+class HeadlessSimulation:
+    """N copies of the ball-seeking Simulation, without Ursina or OpenGL.
+
+    Every environment is one slot of a set of NumPy arrays and all of them
+    advance in lockstep. The robot uses the kinematics of
+    Simulation.updateRobot, integrated with a fixed `dt`, and the ball is
+    placed and reset with the rules of Simulation.init/update. Instead of
+    rendering and thresholding a frame, the ball's position in the
+    ImageProcessor frame (`width` x `height`) is computed analytically by
+    projecting it through the robot camera (`fov` degrees horizontally,
+    pitched down by `camera_angle` degrees).
+
+    The API follows gym's vector environments: reset() returns the
+    observations and step(actions) returns (observations, rewards, dones,
+    info). An environment that is done has already been reset, and the
+    observation returned for it is the first one of its new episode.
+    Episode k of environment e places its ball with a generator of its own,
+    the k-th child of seed_sequences[e], so it can be replayed alone.
+    Observations are a dict of arrays named like the ImageProcessor
+    attributes: "cX", "cY" and "found".
+    """
+
+    # Camera, as set up in Simulation.__init__ (the robot is SIMULATION_ROBOT)
+    camera_height = 1.0
+    ball_height = 0.5
+    ball_radius = 0.5
+    reach_distance = 2
+
+    def __init__(self, num_envs: int = 64, actions=("LEFT", "RIGHT"), seed=None,
+                 action_time: float = 0.25, dt: float = 1 / 60, reset_threshold: float = 30,
+                 width: int = 160, height: int = 120, min_area: int = 30,
+                 fov: float = 62, camera_angle: float = 12, window_aspect: float = 220 / 160):
+        self.num_envs = num_envs
+        self.actions = list(actions)
+        self.motors = np.array([ACTION_MOTORS[action] for action in self.actions], dtype=np.float64)
+        self.ticks_per_action = max(1, round(action_time / dt))
+        self.dt = dt
+        self.reset_threshold = reset_threshold
+        self.width = width
+        self.height = height
+        self.min_area = min_area
+        self.tan_half_fov_x = math.tan(math.radians(fov) / 2)
+        self.tan_half_fov_y = self.tan_half_fov_x / window_aspect
+        self.sin_pitch = math.sin(math.radians(camera_angle))
+        self.cos_pitch = math.cos(math.radians(camera_angle))
+
+        self.seed_sequences = self.spawn_seeds(seed)
+
+        # Robot pose and wheels
+        self.drive = DifferentialDrive(num_envs, **SIMULATION_ROBOT)
+        self.drive.theta[:] = math.pi / 2
+        # Ball on the ground plane (x, z)
+        self.ball_x = np.zeros(num_envs)
+        self.ball_z = np.zeros(num_envs)
+        self.elapsed = np.zeros(num_envs)
+        self.ticks = np.zeros(num_envs, dtype=np.int64)  # Ticks since the episode started
+        self.episodes = np.zeros(num_envs, dtype=np.int64)  # Episodes started per environment
+        # Last detection; cX and cY keep their value while the ball is lost,
+        # like ImageProcessor does
+        self.cX = np.zeros(num_envs, dtype=np.int64)
+        self.cY = np.zeros(num_envs, dtype=np.int64)
+        self.found = np.zeros(num_envs, dtype=bool)
+
+    # Names of Simulation for the arrays of the drive
+    x = property(lambda self: self.drive.x)
+    y = property(lambda self: self.drive.y)
+    q = property(lambda self: self.drive.theta)
+    left_wheel_velocity = property(lambda self: self.drive.left)
+    right_wheel_velocity = property(lambda self: self.drive.right)
+
+    def spawn_seeds(self, seed) -> list:
+        # One SeedSequence per environment from a seed or a SeedSequence
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        return seed.spawn(self.num_envs)
+
+    def init(self, envs: np.ndarray):
+        # Simulation.init for the given environment indices
+        for env in envs:
+            rng = np.random.default_rng(self.seed_sequences[env].spawn(1)[0])
+            self.episodes[env] = self.seed_sequences[env].n_children_spawned
+            self.ball_x[env] = rng.uniform(-8, 8)
+            self.ball_z[env] = rng.uniform(10, 20)
+        self.x[envs] = 0.0
+        self.y[envs] = 0.0
+        self.q[envs] = math.pi / 2
+        self.left_wheel_velocity[envs] = 0
+        self.right_wheel_velocity[envs] = 0
+        self.elapsed[envs] = 0.0
+        self.ticks[envs] = 0
+
+    def reset(self, seed=None) -> dict:
+        if seed is not None:
+            self.seed_sequences = self.spawn_seeds(seed)
+        self.init(np.arange(self.num_envs))
+        self.cX[:] = 0
+        self.cY[:] = 0
+        return self.observe()
+
+    def updateRobot(self):
+        self.drive.step(self.dt)
+
+    def check_reset(self) -> np.ndarray:
+        # Same rules as Simulation.update: ball reached or episode too long
+        distance = np.sqrt((self.ball_x - self.x) ** 2 + self.ball_height ** 2 + (self.ball_z - self.y) ** 2)
+        done = (distance < self.reach_distance) | (self.elapsed > self.reset_threshold)
+        if done.any():
+            self.init(np.flatnonzero(done))
+        return done
+
+    def set_actions(self, actions):
+        motors = self.motors[np.asarray(actions)]
+        self.left_wheel_velocity[:] = motors[:, 0]
+        self.right_wheel_velocity[:] = motors[:, 1]
+
+    def advance(self, ticks: int) -> np.ndarray:
+        # Run ticks fixed physics steps, returns which environments were reset
+        done = np.zeros(self.num_envs, dtype=bool)
+        for _ in range(ticks):
+            done |= self.check_reset()
+            self.updateRobot()
+            self.elapsed += self.dt
+            self.ticks += 1
+        return done
+
+    def step(self, actions):
+        self.set_actions(actions)
+        done = self.advance(self.ticks_per_action)
+        observation = self.observe()
+        return observation, self.reward(), done, {}
+
+    def reward(self) -> np.ndarray:
+        # Same reward as ReinforcementProblem.take_action
+        distFromMiddle = 1 - np.abs(self.cX / self.width - 0.5)
+        return np.power(2, distFromMiddle * 10) + 100 * self.found
+
+    def observe(self) -> dict:
+        dx = self.ball_x - self.x
+        dz = self.ball_z - self.y
+        cos_q = np.cos(self.q)
+        sin_q = np.sin(self.q)
+        forward = dx * cos_q + dz * sin_q
+        right = dx * sin_q - dz * cos_q
+        up = self.ball_height - self.camera_height
+
+        # Ball centre in camera coordinates
+        depth = forward * self.cos_pitch - up * self.sin_pitch
+        camera_y = up * self.cos_pitch + forward * self.sin_pitch
+        in_front = depth > 1e-6
+        depth = np.where(in_front, depth, 1.0)
+
+        # Normalised device coordinates, -1..1 across the frame
+        ndc_x = right / (depth * self.tan_half_fov_x)
+        ndc_y = camera_y / (depth * self.tan_half_fov_y)
+        radius_x = self.ball_radius / (depth * self.tan_half_fov_x) * self.width / 2
+        radius_y = self.ball_radius / (depth * self.tan_half_fov_y) * self.height / 2
+        area = math.pi * radius_x * radius_y
+
+        self.found = in_front & (np.abs(ndc_x) <= 1) & (np.abs(ndc_y) <= 1) & (area > self.min_area)
+        cX = ((ndc_x + 1) / 2 * self.width).astype(np.int64).clip(0, self.width - 1)
+        cY = ((1 - ndc_y) / 2 * self.height).astype(np.int64).clip(0, self.height - 1)
+        self.cX = np.where(self.found, cX, self.cX)
+        self.cY = np.where(self.found, cY, self.cY)
+        return {"cX": self.cX.copy(), "cY": self.cY.copy(), "found": self.found.copy()}
+
+
+if __name__ == '__main__':
+    simulation = HeadlessSimulation(num_envs=1024, seed=0)
+    simulation.reset()
+    rng = np.random.default_rng(0)
+    steps = 200
+    start_time = time.time()
+    for _ in range(steps):
+        simulation.step(rng.integers(len(simulation.actions), size=simulation.num_envs))
+    elapsed_time = time.time() - start_time
+    print(f"{steps * simulation.num_envs / elapsed_time * 3600:.0f} steps per hour")
@@ -0,0 +1,80 @@
+import math
+import time
+import numpy as np
+
+from broadphase import UniformGrid
+from proximity import SENSOR_POSES
+
+
+def in_cone(theta, dx, dy, half_angle):
+    # Whether the direction (dx, dy) lies within half_angle of one of the
+    # horizontal sensors of a robot heading theta
+    angle = np.arctan2(dy, dx) - theta
+    difference = (angle[:, None] - SENSOR_POSES[None, :, 2] + math.pi) % (2 * math.pi) - math.pi
+    return (np.abs(difference) <= half_angle).any(axis=1)
+
+
+class IRComm:
+    """prox.comm between robots: every tick each robot sends its `tx` (0 is
+    silence) and receives one message.
+
+    A message arrives when the receiver is within `range` cm, inside the
+    cone (`cone` degrees wide) of one of the sender's horizontal sensors,
+    and the sender is inside the cone of one of the receiver's. When more
+    robots reach a receiver, it gets the nearest one. Like the AVOIDER and
+    SEEKER programs, rx keeps the last message for `hold` seconds and then
+    falls back to 0.
+    """
+
+    def __init__(self, num_robots, range=20.0, cone=60.0, hold=0.5):
+        self.range = range
+        self.half_angle = math.radians(cone) / 2
+        self.hold = hold
+        self.rx = np.zeros(num_robots, dtype=np.int64)
+        self.received_at = np.full(num_robots, -np.inf)
+
+    def step(self, x, y, theta, tx, now, group=None) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        theta = np.asarray(theta, dtype=np.float64)
+        tx = np.asarray(tx)
+
+        receiver, sender = UniformGrid(x, y, self.range, group).pairs(self.range)
+        sending = tx[sender] != 0
+        receiver, sender = receiver[sending], sender[sending]
+        dx = x[receiver] - x[sender]
+        dy = y[receiver] - y[sender]
+        distance = np.hypot(dx, dy)
+        reached = (in_cone(theta[sender], dx, dy, self.half_angle)
+                   & in_cone(theta[receiver], -dx, -dy, self.half_angle))
+        receiver, sender, distance = receiver[reached], sender[reached], distance[reached]
+
+        # Nearest sender per receiver
+        order = np.lexsort((distance, receiver))
+        receiver, sender = receiver[order], sender[order]
+        receivers, nearest = np.unique(receiver, return_index=True)
+        self.rx[receivers] = tx[sender[nearest]]
+        self.received_at[receivers] = now
+
+        self.rx[now - self.received_at > self.hold] = 0
+        return self.rx.copy()
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    num_robots = 10000
+    comm = IRComm(num_robots)
+    # 1000 games of 10 robots in a 237 x 91 cm arena
+    group = np.repeat(np.arange(1000), 10)
+    x = rng.uniform(0, 237, num_robots)
+    y = rng.uniform(0, 91, num_robots)
+    theta = rng.uniform(0, 2 * math.pi, num_robots)
+    tx = np.where(np.arange(num_robots) % 10 == 0, 1, 2)
+
+    steps = 20
+    start_time = time.time()
+    for step in range(steps):
+        rx = comm.step(x, y, theta, tx, step * 0.1, group)
+    elapsed_time = time.time() - start_time
+    print(f"{steps * num_robots / elapsed_time:.0f} robot ticks per second, "
+          f"{(rx != 0).mean() * 100:.1f}% receive something")
@@ -0,0 +1,90 @@
+import math
+import time
+import numpy as np
+
+# Robot roles, as in robot/qlearning-sim-metal.py
+SEEKER = 0
+AVOIDER = 1
+
+# Robot models. Wheel speeds are motor values times motor_scale, and
+# omega = turn_sign * wheel_radius * (right - left) / (2 * axle).
+# Simulation.updateRobot and HeadlessSimulation: metres, motors as speeds
+SIMULATION_ROBOT = dict(wheel_radius=0.05, axle=2)
+# AvoiderRobot.move in archive/Q-Learning-Sim.py: cm, motor 500 = 10 cm/s,
+# theta turns the other way and gets gaussian noise every step
+ARENA_ROBOT = dict(wheel_radius=2.2, axle=5, motor_scale=10 / 500, turn_sign=-1, heading_noise=0.01)
+# A real Thymio in cm: motor 500 is 20 cm/s, wheels 9.4 cm apart
+THYMIO_ROBOT = dict(wheel_radius=1, axle=4.7, motor_scale=20 / 500)
+
+
+def integrate(x, y, theta, left, right, dt, wheel_radius, axle, motor_scale=1.0, turn_sign=1,
+              noise=None):
+    # One Euler step of differential drive kinematics, for scalars or arrays.
+    # Returns the new (x, y, theta); noise is added to theta after wrapping.
+    left = left * motor_scale
+    right = right * motor_scale
+    speed = wheel_radius * (left + right) / 2
+    omega = turn_sign * wheel_radius * (right - left) / (2 * axle)
+    x = x + np.cos(theta) * speed * dt
+    y = y + np.sin(theta) * speed * dt
+    theta = (theta + omega * dt) % (2 * math.pi)
+    if noise is not None:
+        theta = theta + noise
+    return x, y, theta
+
+
+class DifferentialDrive:
+    """Poses and motors of many differential drive robots, as arrays.
+
+    `shape` can be a number of robots or e.g. (episodes, robots) to run many
+    games side by side. x, y, theta, left, right and role are arrays of that
+    shape that are updated in place, so views of them stay valid. step()
+    advances all robots with the same kinematics as `integrate`, using
+    `rng` for the heading noise.
+    """
+
+    def __init__(self, shape, wheel_radius, axle, motor_scale=1.0, turn_sign=1, heading_noise=0.0,
+                 rng: np.random.Generator = None):
+        self.shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        self.wheel_radius = wheel_radius
+        self.axle = axle
+        self.motor_scale = motor_scale
+        self.turn_sign = turn_sign
+        self.heading_noise = heading_noise
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        self.x = np.zeros(self.shape)
+        self.y = np.zeros(self.shape)
+        self.theta = np.zeros(self.shape)
+        self.left = np.zeros(self.shape)  # motor values
+        self.right = np.zeros(self.shape)
+        self.role = np.full(self.shape, AVOIDER, dtype=np.int8)
+
+    def set_motors(self, left, right, index=...):
+        self.left[index] = left
+        self.right[index] = right
+
+    def set_pose(self, x, y, theta, index=...):
+        self.x[index] = x
+        self.y[index] = y
+        self.theta[index] = theta
+
+    def step(self, dt):
+        noise = None
+        if self.heading_noise > 0:
+            noise = self.rng.normal(0, self.heading_noise, self.shape)
+        self.x[...], self.y[...], self.theta[...] = integrate(
+            self.x, self.y, self.theta, self.left, self.right, dt, self.wheel_radius, self.axle,
+            self.motor_scale, self.turn_sign, noise)
+
+
+if __name__ == '__main__':
+    # 1000 games of 20 robots each
+    drive = DifferentialDrive((1000, 20), rng=np.random.default_rng(0), **ARENA_ROBOT)
+    drive.set_motors(500, 400)
+    steps = 1000
+    start_time = time.time()
+    for _ in range(steps):
+        drive.step(0.1)
+    elapsed_time = time.time() - start_time
+    print(f"{steps * drive.x.size / elapsed_time:.0f} robot steps per second")
@@ -0,0 +1,183 @@
+import math
+import time
+import numpy as np
+
+from broadphase import UniformGrid
+
+# Thymio horizontal proximity sensors as (x, y, angle) in the robot frame:
+# cm from the middle of the wheel axle, x forward and y to the left, angle
+# in radians from the heading. Same order as prox.horizontal: the 5 front
+# sensors from left to right, then back left and back right.
+SENSOR_POSES = np.array([
+    (6.2, 4.85, math.radians(40)),
+    (7.5, 2.55, math.radians(20)),
+    (7.95, 0.0, 0.0),
+    (7.5, -2.55, math.radians(-20)),
+    (6.2, -4.85, math.radians(-40)),
+    (-2.95, 2.95, math.pi),
+    (-2.95, -2.95, math.pi),
+])
+NUM_SENSORS = len(SENSOR_POSES)
+
+# Outline of the robot body in the robot frame (cm), as seen by other robots
+BODY = np.array([(-3.0, -5.6), (8.0, -5.6), (8.0, 5.6), (-3.0, 5.6)])
+# Distance from the robot position to the furthest point of its body
+BODY_RADIUS = float(np.hypot(BODY[:, 0], BODY[:, 1]).max())
+
+# Calibration of report/plots.ipynb: raw sensor values at distances in cm
+CALIBRATION_CM = [0, 2.5, 5, 7.5]
+FRONT_VALUES = [4400, 3500, 2100, 1500]
+BACK_VALUES = [4400, 3700, 1700, 1300]
+
+
+def box_walls(width, height) -> np.ndarray:
+    # The 4 walls of a width x height arena with a corner at the origin
+    corners = np.array([(0, 0), (width, 0), (width, height), (0, height)], dtype=np.float64)
+    return np.stack([corners, np.roll(corners, -1, axis=0)], axis=1)
+
+
+def to_world(points, x, y, theta) -> np.ndarray:
+    # (P, 2) robot frame points of N robots -> (N, P, 2) world points
+    cos_t = np.cos(theta)[:, None]
+    sin_t = np.sin(theta)[:, None]
+    px = points[None, :, 0]
+    py = points[None, :, 1]
+    return np.stack([x[:, None] + px * cos_t - py * sin_t,
+                     y[:, None] + px * sin_t + py * cos_t], axis=-1)
+
+
+def body_segments(x, y, theta) -> np.ndarray:
+    # (N * 4, 2, 2) outline segments of N robots
+    corners = to_world(BODY, x, y, theta)
+    return np.stack([corners, np.roll(corners, -1, axis=1)], axis=2).reshape(-1, 2, 2)
+
+
+def sensor_rays(x, y, theta):
+    # Origins and unit directions of all beams, both (N, NUM_SENSORS, 2)
+    origins = to_world(SENSOR_POSES[:, :2], x, y, theta)
+    angles = theta[:, None] + SENSOR_POSES[None, :, 2]
+    directions = np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+    return origins, directions
+
+
+def ray_distances(p, d, a, e, max_range) -> np.ndarray:
+    # Distance along rays from p with unit directions d to segments from a
+    # to a + e, all (..., 2) and broadcast together; max_range on a miss
+    ap = a - p
+    cross = d[..., 0] * e[..., 1] - d[..., 1] * e[..., 0]
+    parallel = np.abs(cross) < 1e-12
+    cross = np.where(parallel, 1.0, cross)
+    t = (ap[..., 0] * e[..., 1] - ap[..., 1] * e[..., 0]) / cross
+    u = (ap[..., 0] * d[..., 1] - ap[..., 1] * d[..., 0]) / cross
+    hit = ~parallel & (t >= 0) & (t <= max_range) & (u >= 0) & (u <= 1)
+    return np.where(hit, t, max_range)
+
+
+def cast_rays(origins, directions, segments, max_range, ray_owner=None, segment_owner=None,
+              chunk_size=1 << 22) -> np.ndarray:
+    """Distance along every ray to the nearest segment, in one batched call.
+
+    origins and directions are (R, 2), with unit directions, and segments
+    are (S, 2, 2). A ray never hits segments with the same owner id, e.g.
+    the body of the robot it belongs to (walls use owner -1). Rays that hit
+    nothing within max_range get max_range. The R x S intersection tests
+    are split in chunks of about chunk_size pairs to bound the memory used.
+    """
+    distances = np.full(len(origins), float(max_range))
+    if len(segments) == 0 or len(origins) == 0:
+        return distances
+
+    a = segments[None, :, 0]
+    e = segments[None, :, 1] - segments[None, :, 0]
+    step = max(1, chunk_size // len(segments))
+    for start in range(0, len(origins), step):
+        t = ray_distances(origins[start:start + step, None, :], directions[start:start + step, None, :],
+                          a, e, max_range)
+        if ray_owner is not None:
+            t = np.where(ray_owner[start:start + step, None] != segment_owner[None, :], t, max_range)
+        distances[start:start + step] = t.min(axis=1)
+    return distances
+
+
+def sensor_values(distances) -> np.ndarray:
+    # Raw prox.horizontal values of (N, NUM_SENSORS) distances in cm,
+    # 0 from the end of the calibrated range on
+    values = np.empty(distances.shape)
+    values[:, :5] = np.interp(distances[:, :5], CALIBRATION_CM, FRONT_VALUES, right=0)
+    values[:, 5:] = np.interp(distances[:, 5:], CALIBRATION_CM, BACK_VALUES, right=0)
+    values[distances >= CALIBRATION_CM[-1]] = 0
+    return values
+
+
+class ProximitySensors:
+    """The 7 horizontal proximity sensors of a group of Thymios.
+
+    All beams of all robots are cast against the bodies of the other robots
+    and the `walls` ((W, 2, 2) segments, e.g. from box_walls) at once.
+    Poses are arrays of x, y (cm) and theta (radians), one entry per robot,
+    and robots of different `group`s (e.g. episodes) do not see each other.
+    Beams are only tested against the bodies of the robots a UniformGrid
+    finds along them, so many robots cost about linear time.
+    """
+
+    def __init__(self, walls=None, max_range=CALIBRATION_CM[-1], noise=0.0):
+        self.walls = np.zeros((0, 2, 2)) if walls is None else np.asarray(walls, dtype=np.float64)
+        self.max_range = max_range
+        self.noise = noise
+
+    def scan(self, x, y, theta, group=None):
+        # Distances (N, NUM_SENSORS) and the points the beams end at (N, NUM_SENSORS, 2)
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        theta = np.atleast_1d(np.asarray(theta, dtype=np.float64))
+        group = None if group is None else np.atleast_1d(np.asarray(group))
+        num_robots = len(x)
+
+        origins, directions = sensor_rays(x, y, theta)
+        ray_origins = origins.reshape(-1, 2)
+        ray_directions = directions.reshape(-1, 2)
+        distances = cast_rays(ray_origins, ray_directions, self.walls, self.max_range)
+
+        # Bodies of other robots: each beam against the 4 sides of the
+        # robots that may be in its way
+        grid = UniformGrid(x, y, self.max_range / 2 + BODY_RADIUS, group)
+        ray_owner = np.repeat(np.arange(num_robots), NUM_SENSORS)
+        ray_group = None if group is None else group[ray_owner]
+        ray, robot = grid.query_ray(ray_origins, ray_directions, self.max_range, BODY_RADIUS, ray_group)
+        other = robot != ray_owner[ray]
+        ray, robot = ray[other], robot[other]
+        if len(ray):
+            segments = body_segments(x, y, theta).reshape(num_robots, len(BODY), 2, 2)[robot]
+            t = ray_distances(ray_origins[ray, None], ray_directions[ray, None], segments[:, :, 0],
+                              segments[:, :, 1] - segments[:, :, 0], self.max_range)
+            np.minimum.at(distances, ray, t.min(axis=1))
+
+        distances = distances.reshape(num_robots, NUM_SENSORS)
+        points = origins + directions * distances[..., None]
+        return distances, points
+
+    def read(self, x, y, theta, rng: np.random.Generator = None, group=None) -> np.ndarray:
+        # prox.horizontal values (N, NUM_SENSORS)
+        distances, _ = self.scan(x, y, theta, group)
+        values = sensor_values(distances)
+        if self.noise > 0:
+            rng = rng if rng is not None else np.random.default_rng()
+            values = np.where(values > 0, values + rng.normal(0, self.noise, values.shape), 0)
+        return values.clip(0, None).astype(np.int64)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    num_robots = 256
+    sensors = ProximitySensors(box_walls(95, 225))
+    x = rng.uniform(0, 95, num_robots)
+    y = rng.uniform(0, 225, num_robots)
+    theta = rng.uniform(0, 2 * math.pi, num_robots)
+
+    steps = 20
+    start_time = time.time()
+    for _ in range(steps):
+        values = sensors.read(x, y, theta)
+    elapsed_time = time.time() - start_time
+    print(f"{steps * num_robots / elapsed_time:.0f} robot scans per second, "
+          f"{(values > 0).any(axis=1).sum()} of {num_robots} robots see something")
@@ -1,22 +1,48 @@
 from ursina import *
+import ctypes
 import numpy as np
-from OpenGL.GL import glReadPixels, GL_RGB, GL_UNSIGNED_BYTE
+from OpenGL.GL import (
+    glReadPixels, glPixelStorei, glGenBuffers, glBindBuffer, glBufferData, glMapBuffer, glUnmapBuffer,
+    GL_BGR, GL_UNSIGNED_BYTE, GL_PACK_ALIGNMENT, GL_PIXEL_PACK_BUFFER, GL_STREAM_READ, GL_READ_ONLY,
+)
+from panda3d.core import loadPrcFileData
 import cv2
-import random
 import math
+import os
+import sys
 import time as pytime
+# kinematics.py is a sibling, also when this is imported as simulation.simulation
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from kinematics import SIMULATION_ROBOT, integrate
 
 
 class Simulation:
-    def __init__(self):
+    def __init__(self, fixed_dt=None, action_time=0.25, headless=False, seed=None):
         # Ursina setup
         self.reset_threshold = 30
         self.current_action = "STOP"
-        self.app = Ursina(borderless=False, size=(220, 160))
+
+        # Fixed timestep mode: physics advances fixed_dt per tick and
+        # step_action() runs action_time worth of ticks, then renders once.
+        # Without fixed_dt the robot moves with the frame time in update().
+        self.fixed_dt = fixed_dt
+        self.ticks_per_action = max(1, round(action_time / fixed_dt)) if fixed_dt else 0
+        self.ticks = 0
+        # Places the ball; with a seed and fixed_dt a run can be repeated
+        self.rng = np.random.default_rng(seed)
+
+        # Headless: render into an offscreen buffer of an EGL/OSMesa context,
+        # no window or display server needed
+        self.headless = headless
+        if headless:
+            loadPrcFileData('', 'load-display p3headlessgl\naux-display p3osmesadisplay')
+            self.app = Ursina(window_type='offscreen', size=(220, 160))
+        else:
+            self.app = Ursina(borderless=False, size=(220, 160))
 
         # Create entities
         self.ground = Entity(model='plane', scale=(50, 1, 50), position=(0, 0, 0), texture=load_texture('ground.png'))
-        self.tennis_ball = Entity(model='sphere', color=color.green, scale=1, position=(random.uniform(-5, 5), 0.5, random.uniform(10, 20)))
+        self.tennis_ball = Entity(model='sphere', color=color.green, scale=1, position=(self.rng.uniform(-5, 5), 0.5, self.rng.uniform(10, 20)))
         self.robot = Entity(model='cube', color=color.red, scale=(1, 1, 1), position=(0, 0.5, 0))
 
         # Setup Camera
@@ -38,46 +64,87 @@ class Simulation:
         self.light_front = DirectionalLight(rotation=(90 - light_angle, 270, 0))
         self.light_front = DirectionalLight(rotation=(-90, 0, 0))  # bottom
 
-        # Create NumPy buffer to hold frame data
+        # Create NumPy buffer to hold frame data. frame is a view of it that
+        # is already top-down, so no copy is needed to flip it.
         self.width, self.height = map(int, window.size)
         self.numpy_frame = np.zeros((self.width * self.height * 3), dtype=np.uint8)
+        self.frame = self.numpy_frame.reshape(self.height, self.width, 3)[::-1]
+
+        # Two pixel buffer objects, created with the first capture. With
+        # async_readback a capture starts reading the current frame into one
+        # and returns the previous frame from the other, so the CPU never
+        # waits for the GPU. Fixed timestep mode needs the frame it just
+        # rendered, so it reads synchronously.
+        self.pbos = None
+        self.pbo_index = 0
+        self.frames_read = 0
+        self.async_readback = fixed_dt is None
 
         # Reset
         self.init()
 
     def init(self):
-        self.tennis_ball.position=(random.uniform(-8, 8), 0.5, random.uniform(10, 20))
+        self.tennis_ball.position=(self.rng.uniform(-8, 8), 0.5, self.rng.uniform(10, 20))
         self.x = 0.0  # Robot position (x)
         self.y = 0.0  # Robot position (y)
         self.q = math.pi/2  # Robot heading in radians
         self.left_wheel_velocity = 0
         self.right_wheel_velocity = 0
         self.start_time = pytime.time()
+        self.start_tick = self.ticks
+
+    def elapsed_time(self):
+        if self.fixed_dt is None:
+            return pytime.time() - self.start_time
+        return (self.ticks - self.start_tick) * self.fixed_dt
 
     def set_motors(self, values):
         self.left_wheel_velocity = values[0]
         self.right_wheel_velocity = values[1]
 
+    def setup_readback(self):
+        # Must run with the GL context current, i.e. after the first frame
+        self.pbos = glGenBuffers(2)
+        for pbo in self.pbos:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.numpy_frame.nbytes, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
     def capture_frame_to_numpy(self):
-        glReadPixels(0, 0, self.width, self.height, GL_RGB, GL_UNSIGNED_BYTE, self.numpy_frame)
-        # Reshape to (height, width, 3) for RGB format and flip vertically
-        numpy_frame_rgb = np.frombuffer(self.numpy_frame, dtype=np.uint8).reshape(int(self.height), int(self.width), 3)
-        numpy_frame_rgb = np.flipud(numpy_frame_rgb)  # Flip vertically as OpenGL reads bottom to top
-        # Convert from BGR to RGB (OpenGL outputs BGR, OpenCV expects RGB)
-        numpy_frame_rgb = np.flip(numpy_frame_rgb, axis=-1)
-        return numpy_frame_rgb
-
-    def updateRobot(self):
-        R = 0.05  # radius of wheels in meters
-        L = 2  # distance between wheels in meters
-
-        v_x = cos(self.q) * (R * self.left_wheel_velocity / 2 + R * self.right_wheel_velocity / 2)
-        v_y = sin(self.q) * (R * self.left_wheel_velocity / 2 + R * self.right_wheel_velocity / 2)
-        omega = (R * self.right_wheel_velocity - R * self.left_wheel_velocity) / (2 * L)
-
-        self.x += v_x * time.dt
-        self.y += v_y * time.dt
-        self.q = (self.q + omega * time.dt)%(2*math.pi)
+        # Returns a (height, width, 3) BGR view of self.numpy_frame, as OpenCV
+        # expects it. The buffer is reused, so the next capture overwrites it.
+        if self.pbos is None:
+            self.setup_readback()
+
+        # Start reading the current frame into one pixel buffer. OpenGL can
+        # give BGR directly; rows still come bottom to top.
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[self.pbo_index])
+        glReadPixels(0, 0, self.width, self.height, GL_BGR, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+
+        # Map the buffer that holds a finished read
+        if self.async_readback and self.frames_read > 0:
+            read_index = 1 - self.pbo_index
+        else:
+            read_index = self.pbo_index
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[read_index])
+        pointer = glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY)
+        if pointer:
+            ctypes.memmove(self.numpy_frame.ctypes.data, pointer, self.numpy_frame.nbytes)
+            glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        self.pbo_index = 1 - self.pbo_index
+        self.frames_read += 1
+        return self.frame
+
+    def updateRobot(self, dt=None):
+        if dt is None:
+            dt = time.dt
+        # Same kinematics as HeadlessSimulation, for one robot
+        x, y, q = integrate(self.x, self.y, self.q, self.left_wheel_velocity, self.right_wheel_velocity,
+                            dt, **SIMULATION_ROBOT)
+        self.x, self.y, self.q = float(x), float(y), float(q)
 
         self.robot.position = (self.x, 0, self.y)
         self.robot.rotation = (0, math.degrees(-self.q) + 90, 0)
@@ -97,24 +164,44 @@ class Simulation:
         if held_keys['s']:
             self.camera_angle += 1
 
+        # Update camera
+        camera.rotation = Vec3(self.camera_angle, camera.rotation_y, camera.rotation_z)
+
+        # Update frame
+        # frame_array = self.capture_frame_to_numpy()
+        # cv2.imshow("Frame", frame_array)
+        # cv2.waitKey(1)  # Display frame briefly in a non-blocking way
+        if self.fixed_dt is None:
+            self.check_reset()
+            self.updateRobot()
+
+    def check_reset(self):
         dis = distance(self.robot, self.tennis_ball.position)
         if dis < 2:
             print("Reset - distance between entities:", dis)
             self.init()
 
-        elapsed_time = pytime.time() - self.start_time
+        elapsed_time = self.elapsed_time()
         if elapsed_time > self.reset_threshold:
             print(f"Game has been running for {elapsed_time:.2f} seconds. Resetting game...")
             self.init()
 
-        # Update camera
-        camera.rotation = Vec3(self.camera_angle, camera.rotation_y, camera.rotation_z)
-
-        # Update frame
-        # frame_array = self.capture_frame_to_numpy()
-        # cv2.imshow("Frame", frame_array)
-        # cv2.waitKey(1)  # Display frame briefly in a non-blocking way
-        self.updateRobot()
+    def tick(self):
+        # One fixed physics step, nothing is rendered
+        self.check_reset()
+        self.updateRobot(self.fixed_dt)
+        self.ticks += 1
+
+    def render(self):
+        # Draw one frame so capture_frame_to_numpy sees the current pose
+        self.update()
+        self.app.step()
+
+    def step_action(self, action: str):
+        self.perform_action(action)
+        for _ in range(self.ticks_per_action):
+            self.tick()
+        self.render()
 
     def perform_action(self, action: str):
         if action == "LEFT":
@@ -0,0 +1,197 @@
+import math
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+import numpy as np
+sys.path.append('../')
+
+from robot.sensor_snapshot import SensorFeed
+from robot.BehaviouralModule import behaviouralModule
+from broadphase import UniformGrid
+from kinematics import SEEKER, AVOIDER, THYMIO_ROBOT, DifferentialDrive
+from proximity import ProximitySensors
+from ground import ArenaMap
+from ircomm import IRComm
+
+# prox.comm.tx of the SEEKER and AVOIDER programs in robot/robot2.py
+TX = {SEEKER: 1, AVOIDER: 2}
+# Robots collide as circles of this radius (cm), half the width of a Thymio
+ROBOT_RADIUS = 5.6
+
+
+class SimulatedThymio:
+    """Stand-in for ThymioController, driven by a TagMatch.
+
+    It has the parts of the controller interface that behaviouralModule
+    uses: sensor snapshots, set_motors/set_led and process_image, which
+    returns the x of the nearest avoider in the camera image (or False).
+    """
+
+    reflexes = None  # No Aseba reflexes, behaviouralModule reacts itself
+
+    def __init__(self, robot_type) -> None:
+        self.robot_type = robot_type
+        self.sensors = SensorFeed()
+        self.motor_values = (0, 0)
+        self.led_values = (0, 0, 255)
+        self.reflex_active = False
+        self.is_safe = False
+        self.running = True
+        self.tagged = False
+        self.camera_target = False
+
+    @property
+    def snapshot(self):
+        return self.sensors.latest
+
+    @property
+    def horizontal_sensors(self):
+        snapshot = self.sensors.latest
+        return snapshot.prox if snapshot is not None else None
+
+    @property
+    def ground_sensors(self):
+        snapshot = self.sensors.latest
+        return snapshot.ground if snapshot is not None else None
+
+    def set_motors(self, values):
+        self.motor_values = tuple(values)
+
+    def set_led(self, values):
+        self.led_values = tuple(values)
+
+    def process_image(self, **image_settings):
+        return self.camera_target
+
+
+class TagMatch:
+    """A game of tag between one seeker and `num_avoiders` avoiders, all run
+    by behaviouralModule on simulated Thymios.
+
+    Every tick of `dt` seconds the horizontal sensors (ProximitySensors),
+    ground sensors (ArenaMap) and prox.comm (IRComm) of all robots are
+    computed at once and published as sensor snapshots, then every
+    behaviour ticks and the motors it sets drive the robots. Robots that
+    end up overlapping are pushed apart. As in the
+    README, the seeker starts in the middle, the avoiders in the corners,
+    and an avoider that receives the seeker's "1" is tagged.
+    """
+
+    def __init__(self, num_avoiders=4, arena: ArenaMap = None, dt=0.1, duration=180, max_speed=200,
+                 seed=None, camera_fov=62, camera_width=820, camera_range=150):
+        # One generator for the world, one for every robot's behaviour
+        world_seed, *behaviour_seeds = np.random.SeedSequence(seed).spawn(2 + num_avoiders)
+        self.rng = np.random.default_rng(world_seed)
+        self.arena = arena if arena is not None else ArenaMap.rectangle()
+        self.dt = dt
+        self.duration = duration
+        self.camera_half_fov = math.radians(camera_fov) / 2
+        self.camera_width = camera_width
+        self.camera_range = camera_range
+
+        num_robots = 1 + num_avoiders
+        self.roles = np.array([SEEKER] + [AVOIDER] * num_avoiders)
+        self.drive = DifferentialDrive(num_robots, rng=self.rng, **THYMIO_ROBOT)
+        self.drive.role[:] = self.roles
+        self.proximity = ProximitySensors(noise=20)
+        self.comm = IRComm(num_robots)
+        self.tx = np.array([TX[role] for role in self.roles])
+
+        self.robots = [SimulatedThymio("SEEKER" if role == SEEKER else "AVOIDER") for role in self.roles]
+        self.behaviours = [behaviouralModule(robot, max_speed=max_speed, robot_type=robot.robot_type,
+                                             rng=np.random.default_rng(behaviour_seed))
+                           for robot, behaviour_seed in zip(self.robots, behaviour_seeds)]
+        self.tagged_at = np.full(num_robots, np.nan)
+        self.now = 0.0
+        self.place_robots()
+
+    def place_robots(self):
+        width, height = self.arena.width_cm, self.arena.height_cm
+        margin = 20
+        corners = [(margin, margin), (width - margin, margin),
+                   (margin, height - margin), (width - margin, height - margin)]
+        x = [width / 2]
+        y = [height / 2]
+        for i in range(len(self.robots) - 1):
+            corner_x, corner_y = corners[i % len(corners)]
+            x.append(corner_x)
+            y.append(corner_y)
+        x = np.array(x)
+        y = np.array(y)
+        # Avoiders face the middle, the seeker a random way
+        theta = np.arctan2(height / 2 - y, width / 2 - x)
+        theta[0] = self.rng.uniform(0, 2 * math.pi)
+        self.drive.set_pose(x, y, theta)
+
+    def update_camera(self):
+        # The seeker's camera sees the nearest avoider in its field of view
+        drive = self.drive
+        seeker = self.robots[0]
+        dx = drive.x[1:] - drive.x[0]
+        dy = drive.y[1:] - drive.y[0]
+        angle = (np.arctan2(dy, dx) - drive.theta[0] + math.pi) % (2 * math.pi) - math.pi
+        distance = np.hypot(dx, dy)
+        visible = (np.abs(angle) < self.camera_half_fov) & (distance < self.camera_range)
+        if not visible.any():
+            seeker.camera_target = False
+            return
+        nearest = np.flatnonzero(visible)[np.argmin(distance[visible])]
+        offset = math.tan(angle[nearest]) / math.tan(self.camera_half_fov)
+        seeker.camera_target = int((1 - offset) / 2 * (self.camera_width - 1)) or 1
+
+    def step(self):
+        drive = self.drive
+        prox = self.proximity.read(drive.x, drive.y, drive.theta, self.rng)
+        ground = self.arena.ground_sensors(drive.x, drive.y, drive.theta)
+        rx = self.comm.step(drive.x, drive.y, drive.theta, self.tx, self.now)
+        self.update_camera()
+
+        for i, (robot, behaviour) in enumerate(zip(self.robots, self.behaviours)):
+            robot.sensors.publish(prox=prox[i], ground=ground[i].astype(int), rx=int(rx[i]))
+            if robot.robot_type == "AVOIDER" and rx[i] == 1 and not robot.tagged:
+                robot.tagged = True
+                self.tagged_at[i] = self.now
+            behaviour.update(self.now)
+            drive.set_motors(*robot.motor_values, index=i)
+
+        drive.step(self.dt)
+        self.separate()
+        self.now += self.dt
+
+    def separate(self):
+        # Push overlapping robots apart, each by half of the overlap
+        drive = self.drive
+        i, j = UniformGrid(drive.x, drive.y, 2 * ROBOT_RADIUS).pairs(2 * ROBOT_RADIUS)
+        if len(i) == 0:
+            return
+        dx = drive.x[i] - drive.x[j]
+        dy = drive.y[i] - drive.y[j]
+        distance = np.maximum(np.hypot(dx, dy), 1e-9)
+        push = (2 * ROBOT_RADIUS - distance) / 2 / distance
+        np.add.at(drive.x, i, dx * push)
+        np.add.at(drive.y, i, dy * push)
+
+    def finished(self) -> bool:
+        return self.now >= self.duration or all(robot.tagged for robot in self.robots[1:])
+
+    def run(self, quiet=True) -> dict:
+        # Play until all avoiders are tagged or time is up
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull if quiet else sys.stdout):
+            while not self.finished():
+                self.step()
+        return {
+            "time": self.now,
+            "tagged": int(sum(robot.tagged for robot in self.robots[1:])),
+            "tagged_at": self.tagged_at[1:].tolist(),
+        }
+
+
+if __name__ == '__main__':
+    num_matches = 10
+    start_time = time.time()
+    results = [TagMatch(seed=seed).run() for seed in range(num_matches)]
+    elapsed_time = time.time() - start_time
+    for seed, result in enumerate(results):
+        print(f"match {seed}: {result['tagged']} tagged in {result['time']:.1f} s")
+    print(f"{sum(result['time'] for result in results) / elapsed_time:.0f}x real time")
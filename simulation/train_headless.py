@@ -0,0 +1,46 @@
+import sys
+sys.path.append('../')
+
+import numpy as np
+from robot.q_table import State, Action, QValueStore, BatchQLearner
+from headless import HeadlessSimulation
+
+
+def get_states(simulation: HeadlessSimulation, observation: dict) -> np.ndarray:
+    return State.observe_array(observation["cX"], observation["found"], simulation.width)
+
+
+if __name__ == "__main__":
+    store = QValueStore("training")
+    simulation = HeadlessSimulation(num_envs=256, actions=("LEFT", "RIGHT"), seed=0)
+
+    learning_rate = 0.1
+    discount_rate = 0.75
+    exploration_rate = 0.1
+
+    learner = BatchQLearner(store, [Action(action) for action in simulation.actions],
+                            learning_rate, discount_rate, exploration_rate, rng=np.random.default_rng(0))
+
+    save_iterations = 100
+    total_change = 0
+    num_changes = 0
+    states = get_states(simulation, simulation.reset())
+    i = 0
+    try:
+        while True:
+            actions = learner.choose_actions(states)
+            observation, rewards, dones, _ = simulation.step(actions)
+            new_states = get_states(simulation, observation)
+            total_change += learner.update(states, actions, rewards, new_states)
+            num_changes += 1
+            states = new_states
+
+            if i % save_iterations == 0:
+                store.save()
+                print(f"iteration {i}: steps {i * simulation.num_envs} average q-value change: {total_change / num_changes:.02f}")
+                total_change = 0
+                num_changes = 0
+            i += 1
+    except KeyboardInterrupt:
+        store.close()
+        store.print_best_action_per_state()